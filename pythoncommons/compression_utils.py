@@ -0,0 +1,125 @@
+import bz2
+import gzip
+import io
+import lzma
+import queue
+import threading
+
+"""
+Transparent opening of plain and compressed (.gz, .bz2, .xz) files, chosen by
+file extension, with streaming (de)compression. Compressed files can also be
+read with decompression running on a background thread, so that it overlaps
+with parsing the decompressed text.
+"""
+
+compressed_openers = {'.gz': gzip.open,
+                      '.bz2': bz2.open,
+                      '.xz': lzma.open,
+                      '.lzma': lzma.open}
+
+
+def get_compressed_opener(file_name):
+    """Returns the open function for a compressed file name, or None if the file
+    name does not have a compressed extension.
+    """
+    for extension, opener in compressed_openers.items():
+        if str(file_name).endswith(extension):
+            return opener
+    return None
+
+
+def is_compressed(file_name):
+    return get_compressed_opener(file_name) is not None
+
+
+class BackgroundReader(io.RawIOBase):
+    """Raw binary stream whose data is read from another binary stream by a
+    background thread, keeping at most prefetch blocks of block_size bytes queued.
+    """
+
+    def __init__(self, source, block_size=1048576, prefetch=4):
+        self.source = source
+        self.block_size = block_size
+        self.blocks = queue.Queue(maxsize=max(prefetch, 1))
+        self.stop = threading.Event()
+        self.current = b''
+        self.finished = False
+        self.thread = threading.Thread(target=self.produce, daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce(self):
+        try:
+            while True:
+                block = self.source.read(self.block_size)
+                if not block:
+                    break
+                if not self.put(block):
+                    return
+            self.put(None)
+        except BaseException as error:
+            self.put(error)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.current:
+            if self.finished:
+                return 0
+            block = self.blocks.get()
+            if block is None:
+                self.finished = True
+                return 0
+            if isinstance(block, BaseException):
+                self.finished = True
+                raise block
+            self.current = block
+        size = min(len(buffer), len(self.current))
+        buffer[:size] = self.current[:size]
+        self.current = self.current[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.stop.set()
+            self.thread.join()
+            self.source.close()
+        super(BackgroundReader, self).close()
+
+
+def open_file(file_name, mode='rt', background=False, buffer_size=1048576):
+    """Opens a plain or compressed file, choosing the compression from the file
+    extension. Text modes are supported for compressed files as well, and '+' is
+    dropped from append modes since compressed streams cannot be read and written
+    at once (appending to a compressed file adds a new compressed member). If
+    background is True, a compressed file opened for reading is decompressed on a
+    background thread.
+    """
+    opener = get_compressed_opener(file_name)
+    if opener is None:
+        return open(file_name, mode, buffering=buffer_size)
+    mode = mode.replace('+', '')
+    binary_mode = mode.replace('t', '')
+    if 'b' not in binary_mode:
+        binary_mode += 'b'
+    if background and mode.startswith('r'):
+        stream = io.BufferedReader(BackgroundReader(opener(file_name, binary_mode), buffer_size),
+                                   buffer_size)
+    else:
+        stream = opener(file_name, binary_mode)
+    if 'b' in mode:
+        return stream
+    return io.TextIOWrapper(stream)
+
+
+if __name__ == '__main__':
+    print('Please use compression_utils as method package.')
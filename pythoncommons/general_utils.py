@@ -1,4 +1,6 @@
+from collections import namedtuple
 from datetime import datetime
+from functools import lru_cache
 from pythoncommons import property_reader_utils
 import os
 import inspect
@@ -279,7 +281,7 @@ def translate_delimiter(delimiter_string):
     """ Takes a descriptive string, like comma, and turns it into
     the thing it describes. comma -> ',' tab -> actual tab
     """
-    delimiter_dictionary = {"comma": ',', "tab": '\t'}
+    delimiter_dictionary = {"comma": ',', "tab": '\t', "pipe": '|', "semicolon": ';'}
     if delimiter_string.isalpha():
         try:
             return delimiter_dictionary[delimiter_string]
@@ -339,6 +341,15 @@ def isnamedtupleinstance(x):
     return all(type(n) == str for n in f)
 
 
+@lru_cache(maxsize=256)
+def get_named_tuple_type(name, fields):
+    """ Returns the named tuple class for the given name and tuple of field names,
+    creating it only the first time it is asked for. Classes are kept in a bounded
+    LRU registry so that rows sharing a shape share one class.
+    """
+    return namedtuple(name, fields)
+
+
 def clean_string(s):
     """ Remove all spaces around string and make the string uppercase.
     """
@@ -1,5 +1,5 @@
 import simplejson as json
-from collections import namedtuple
+from pythoncommons.general_utils import get_named_tuple_type
 
 
 def serialize(thing, thing_type='namedtuple'):
@@ -14,7 +14,7 @@ def serialize(thing, thing_type='namedtuple'):
 
 
 def json_object_hook(d):
-    return namedtuple('X', list(d.keys()))(*list(d.values()))
+    return get_named_tuple_type('X', tuple(d.keys()))(*d.values())
 
 
 def deserialize(thing, thing_type='namedtuple'):
@@ -0,0 +1,156 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from pythoncommons.record_reader_utils import (RecordSchema, make_intervals, make_slices,
+                                               strings_to_ints)
+import mmap
+import os
+
+"""
+Random access reading of fixed width record files. The file is memory mapped
+and indexed by line offset once, after which single records, slices of records,
+or single fields can be decoded without parsing (or copying) the whole file.
+"""
+
+
+def make_line_index(mapped_file, size):
+    """Returns an array of the byte offsets at which each line of the mapped file
+    starts. A trailing newline does not start a new (empty) line.
+    """
+    offsets = array('q')
+    position = 0
+    while position < size:
+        offsets.append(position)
+        line_end = mapped_file.find(b'\n', position)
+        if line_end < 0:
+            break
+        position = line_end + 1
+    return offsets
+
+
+class MappedRecordReader(object):
+    """Memory mapped reader for a fixed width record file described by a list of
+    field tuples as (field_name, field_type) and the field start positions (byte
+    positions). Supports len(reader), reader[i], reader[i:j] and lazy single field
+    decoding with get_field. The reader can be pickled to worker processes, which
+    reopen the file read only and reuse the line index instead of rebuilding it.
+    """
+
+    def __init__(self, record_file, fields, start_positions, type_name='Record',
+                 keyword_converter=None, encoding='utf-8', offsets=None):
+        self.record_file = record_file
+        self.fields = list(fields)
+        self.start_positions = list(start_positions)
+        self.type_name = type_name
+        self.keyword_converter = keyword_converter
+        self.encoding = encoding
+        slices = make_slices(make_intervals(strings_to_ints(self.start_positions)))
+        slices[-1] = slice(slices[-1].start, None)
+        self.schema = RecordSchema(type_name, self.fields, slices)
+        self.field_slices = dict(zip(self.schema.field_names, slices))
+        self.field_converters = dict(zip(self.schema.field_names, self.schema.converters))
+        self.open(offsets)
+
+    def open(self, offsets=None):
+        self.file = open(self.record_file, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        if self.size:
+            self.mapped_file = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.mapped_file = None
+        if offsets is None:
+            offsets = make_line_index(self.mapped_file, self.size)
+        self.offsets = offsets
+
+    def close(self):
+        if self.mapped_file is not None:
+            self.mapped_file.close()
+            self.mapped_file = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ['file', 'mapped_file', 'schema', 'field_slices', 'field_converters']:
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        offsets = state.pop('offsets')
+        self.__init__(offsets=offsets, **{key: state[key] for key in
+                      ['record_file', 'fields', 'start_positions', 'type_name',
+                       'keyword_converter', 'encoding']})
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.get_record(i) for i in range(*index.indices(len(self)))]
+        return self.get_record(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.get_record(index)
+
+    def get_line(self, index):
+        """Returns the raw bytes of the line at the given index, without its line ending.
+        """
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('record index out of range')
+        start = self.offsets[index]
+        end = self.offsets[index + 1] if index + 1 < len(self) else self.size
+        line = self.mapped_file[start:end]
+        return line.rstrip(b'\r\n')
+
+    def get_record(self, index):
+        """Decodes the record at the given index into a named tuple.
+        """
+        line = self.get_line(index)
+        row = [line[interval].strip().decode(self.encoding) for interval in self.schema.slices]
+        return self.schema.make_record(row, self.keyword_converter)
+
+    def get_field(self, index, field_name):
+        """Decodes a single field of the record at the given index, without
+        decoding the rest of the record. Returns None if the value cannot be converted.
+        """
+        value = self.get_line(index)[self.field_slices[field_name]].strip()
+        try:
+            return self.field_converters[field_name](value.decode(self.encoding))
+        except:
+            return None
+
+    def get_key_range(self, field_name, low=None, high=None):
+        """Returns the records whose field_name value is between low and high
+        (inclusive), using a binary search. The file must be sorted on that field.
+        """
+        keys = FieldView(self, field_name)
+        start = 0 if low is None else bisect_left(keys, low)
+        end = len(self) if high is None else bisect_right(keys, high)
+        return self[start:end]
+
+
+class FieldView(object):
+    """Read only sequence view of one field of a MappedRecordReader, decoding
+    each value on access. Used for binary searches over a sorted field.
+    """
+
+    def __init__(self, reader, field_name):
+        self.reader = reader
+        self.field_name = field_name
+
+    def __len__(self):
+        return len(self.reader)
+
+    def __getitem__(self, index):
+        return self.reader.get_field(index, self.field_name)
+
+
+if __name__ == '__main__':
+    print('Please use mapped_record_utils as method package.')
@@ -0,0 +1,103 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from pythoncommons import mongo_utils
+import asyncio
+
+"""
+asyncio versions of the mongo_utils helpers. Each helper runs on a bounded thread
+pool, using the shared pooled clients from mongo_utils.mongo_get_client, so that
+calls do not block the event loop. At most concurrency calls run at once, and
+find results can be iterated asynchronously a batch at a time.
+"""
+
+
+class AsyncMongo(object):
+    """Runs mongo_utils helpers from asyncio code. concurrency bounds the number
+    of helpers running at once (and the size of the thread pool).
+    """
+
+    def __init__(self, concurrency=16):
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.semaphore = None
+
+    async def run(self, function, *args, **kwargs):
+        """Runs a blocking function on the thread pool and returns its result.
+        """
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, partial(function, *args, **kwargs))
+
+    async def gather(self, *coroutines):
+        """Runs several helper calls concurrently (up to the concurrency limit)
+        and returns their results in order.
+        """
+        return await asyncio.gather(*coroutines)
+
+    async def get_connection(self, db_name, connect_string=None, **options):
+        return await self.run(mongo_utils.mongo_get_connection, db_name, connect_string,
+                              **options)
+
+    async def find_records(self, collection, argument=None, sort=None, named_tuple=False,
+                           **stream_options):
+        """Returns the list of matching records (dictionaries, or named tuples with
+        named_tuple=True). Takes the mongo_stream_records options.
+        """
+        def find():
+            return list(mongo_utils.mongo_stream_records(collection, argument, sort, named_tuple,
+                                                         **stream_options))
+        return await self.run(find)
+
+    async def iter_records(self, collection, argument=None, sort=None, named_tuple=False,
+                           batch_size=1000, **stream_options):
+        """Asynchronous generator over the matching records, fetching batch_size
+        records per call on the thread pool.
+        """
+        records = await self.run(mongo_utils.mongo_stream_records, collection, argument, sort,
+                                 named_tuple, batch_size, **stream_options)
+        records = iter(records)
+        while True:
+            batch = await self.run(lambda: list(islice(records, batch_size)))
+            if not batch:
+                return
+            for record in batch:
+                yield record
+
+    async def insert_one(self, collection, record, make_serial=True, decimal_policy='float'):
+        return await self.run(mongo_utils.mongo_insert_one, collection, record, make_serial,
+                              decimal_policy)
+
+    async def insert_many(self, collection, records, make_serial=True, decimal_policy='float'):
+        return await self.run(mongo_utils.mongo_insert_many, collection, records, make_serial,
+                              decimal_policy)
+
+    async def update_one(self, collection, argument, update):
+        return await self.run(mongo_utils.mongo_update_one, collection, argument, update)
+
+    async def replace_one(self, collection, record, argument):
+        return await self.run(mongo_utils.mongo_replace_one, collection, record, argument)
+
+    async def remove_one(self, collection, record):
+        return await self.run(mongo_utils.mongo_remove_one, collection, record)
+
+    async def remove_many(self, collection, record):
+        return await self.run(mongo_utils.mongo_remove_many, collection, record)
+
+    async def clear_collection(self, collection):
+        return await self.run(mongo_utils.mongo_clear_collection, collection)
+
+    def close(self):
+        self.executor.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+
+if __name__ == '__main__':
+    print('Please use mongo_async_utils as method package.')
@@ -0,0 +1,212 @@
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany
+from pymongo.errors import BulkWriteError, PyMongoError
+from bson.errors import BSONError
+from pythoncommons.mongo_utils import to_document, mongo_query_cache
+import threading
+import time
+
+"""
+Buffered bulk writes for mongo collections. Mixed insert, update, upsert,
+replace and delete operations are collected into batches and sent as unordered
+bulk_write calls, with several batches in flight at once and transient write
+errors retried. Each batch reports a result summary dictionary.
+"""
+
+# globals
+transient_error_codes = set([6, 7, 89, 91, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436])
+
+
+def empty_summary(batch, operations):
+    return {'batch': batch,
+            'operations': operations,
+            'inserted': 0,
+            'matched': 0,
+            'modified': 0,
+            'deleted': 0,
+            'upserted': 0,
+            'retries': 0,
+            'errors': []}
+
+
+def add_bulk_result(summary, result):
+    """Adds the counts of a pymongo bulk result (or BulkWriteError details) to a summary.
+    """
+    summary['inserted'] += result.get('nInserted', 0)
+    summary['matched'] += result.get('nMatched', 0)
+    summary['modified'] += result.get('nModified', 0)
+    summary['deleted'] += result.get('nRemoved', 0)
+    summary['upserted'] += result.get('nUpserted', 0)
+
+
+class MongoBulkWriter(object):
+    """Collects write operations for a collection and flushes them as unordered
+    bulk_write batches of batch_size operations, keeping up to max_in_flight
+    batches running on background threads. Transient write errors are retried up
+    to retries times, and other errors are recorded in the batch summary. Records
+    passed to insert and replace are converted with to_document (using
+    decimal_policy) when make_serial is True.
+    Use as a context manager, or call close(), to flush the last batch; both
+    return the list of per batch summaries.
+    """
+
+    def __init__(self, collection, batch_size=1000, max_in_flight=4, retries=3,
+                 retry_delay=0.5, make_serial=True, decimal_policy='float'):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.make_serial = make_serial
+        self.decimal_policy = decimal_policy
+        self.operations = []
+        self.summaries = []
+        self.futures = []
+        self.batch_count = 0
+        self.in_flight = threading.Semaphore(max(max_in_flight, 1))
+        self.executor = ThreadPoolExecutor(max_workers=max(max_in_flight, 1))
+
+    def serialize(self, record):
+        if self.make_serial:
+            return to_document(record, self.decimal_policy)
+        return record
+
+    def add(self, operation):
+        """Adds a pymongo write operation (InsertOne, UpdateOne, etc.) to the batch.
+        """
+        self.operations.append(operation)
+        if len(self.operations) >= self.batch_size:
+            self.send()
+
+    def insert(self, record):
+        self.add(InsertOne(self.serialize(record)))
+
+    def update(self, argument, update, upsert=False, many=False):
+        if many:
+            self.add(UpdateMany(argument, update, upsert=upsert))
+        else:
+            self.add(UpdateOne(argument, update, upsert=upsert))
+
+    def upsert(self, argument, update):
+        self.update(argument, update, upsert=True)
+
+    def replace(self, argument, record, upsert=False):
+        self.add(ReplaceOne(argument, self.serialize(record), upsert=upsert))
+
+    def delete(self, argument, many=False):
+        if many:
+            self.add(DeleteMany(argument))
+        else:
+            self.add(DeleteOne(argument))
+
+    def send(self):
+        """Sends the buffered operations as one batch, waiting first if
+        max_in_flight batches are already running.
+        """
+        if not self.operations:
+            return
+        operations, self.operations = self.operations, []
+        self.batch_count += 1
+        self.in_flight.acquire()
+        try:
+            future = self.executor.submit(self.write_batch, self.batch_count, operations)
+        except:
+            self.in_flight.release()
+            raise
+        future.add_done_callback(lambda done: self.in_flight.release())
+        self.futures.append((self.batch_count, len(operations), future))
+
+    def write_batch(self, batch, operations):
+        """Writes one batch, retrying the operations that failed with a transient
+        write error (those were not applied). Network and other errors are not
+        resent, since part of the batch may already have been applied: they are
+        recorded in the summary's errors (pymongo's retryWrites already retries
+        retryable writes once). Returns the batch summary.
+        """
+        summary = empty_summary(batch, len(operations))
+        attempt = 0
+        while operations:
+            try:
+                result = self.collection.bulk_write(operations, ordered=False)
+                add_bulk_result(summary, result.bulk_api_result)
+                operations = []
+            except BulkWriteError as error:
+                add_bulk_result(summary, error.details)
+                retry_operations = []
+                for write_error in error.details.get('writeErrors', []):
+                    if write_error.get('code') in transient_error_codes and attempt < self.retries:
+                        retry_operations.append(operations[write_error['index']])
+                    else:
+                        summary['errors'].append({'code': write_error.get('code'),
+                                                  'message': write_error.get('errmsg'),
+                                                  'operation': repr(operations[write_error['index']])})
+                operations = retry_operations
+            except (PyMongoError, BSONError) as error:
+                summary['errors'].append({'code': getattr(error, 'code', None),
+                                          'message': str(error),
+                                          'operations': len(operations)})
+                operations = []
+            mongo_query_cache.invalidate(self.collection)
+            if operations:
+                attempt += 1
+                summary['retries'] += 1
+                time.sleep(self.retry_delay * attempt)
+        return summary
+
+    def flush(self):
+        """Sends any buffered operations and waits for every batch in flight.
+        Returns the summaries of all the batches written so far.
+        """
+        self.send()
+        futures, self.futures = self.futures, []
+        for batch, operations, future in futures:
+            try:
+                self.summaries.append(future.result())
+            except Exception as error:
+                summary = empty_summary(batch, operations)
+                summary['errors'].append({'code': None,
+                                          'message': str(error),
+                                          'operations': operations})
+                self.summaries.append(summary)
+        return self.summaries
+
+    def close(self):
+        try:
+            return self.flush()
+        finally:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def mongo_bulk_write(collection, operations, batch_size=1000, max_in_flight=4, retries=3):
+    """Writes an iterable of pymongo write operations through a MongoBulkWriter
+    and returns the list of per batch summaries.
+    """
+    writer = MongoBulkWriter(collection, batch_size, max_in_flight, retries)
+    try:
+        for operation in operations:
+            writer.add(operation)
+    finally:
+        summaries = writer.close()
+    return summaries
+
+
+def mongo_bulk_insert(collection, records, batch_size=1000, max_in_flight=4, make_serial=True):
+    """Inserts an iterable of records in concurrent unordered batches and returns
+    the list of per batch summaries.
+    """
+    writer = MongoBulkWriter(collection, batch_size, max_in_flight, make_serial=make_serial)
+    try:
+        for record in records:
+            writer.insert(record)
+    finally:
+        summaries = writer.close()
+    return summaries
+
+
+if __name__ == '__main__':
+    print('Please use mongo_bulk_utils as method package.')
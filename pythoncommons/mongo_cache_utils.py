@@ -0,0 +1,179 @@
+from bson import json_util
+from collections import OrderedDict
+import json
+import threading
+import time
+
+"""
+A read-through cache of mongo query results. Entries are keyed by client, collection,
+normalized filter, sort and projection, limited in number (least recently used
+entries are evicted first) and optionally expired by a per collection time to
+live. Writes through the mongo_utils helpers invalidate every entry of the
+collection they write to.
+"""
+
+
+def get_collection_name(collection):
+    """Returns the full (database.collection) name of a collection.
+    """
+    return getattr(collection, 'full_name', None) or collection.name
+
+
+def encode_bson_value(value):
+    """json.dumps default for the values of a query argument. BSON types (ObjectId,
+    datetime, Decimal128, regular expressions, ...) are written in canonical
+    extended json, other values by type name and repr, so values of different
+    types never get the same encoding.
+    """
+    try:
+        return json_util.default(value, json_util.CANONICAL_JSON_OPTIONS)
+    except TypeError:
+        return {'$type': type(value).__qualname__, '$repr': repr(value)}
+
+
+def get_collection_key(collection):
+    """Returns the cache identity of a collection: its client and full name, so
+    collections of the same name on different clients (clusters) are kept apart.
+    """
+    client = getattr(getattr(collection, 'database', None), 'client', None)
+    return (id(client) if client is not None else None, get_collection_name(collection))
+
+
+def normalize_argument(argument):
+    """Returns a stable string form of a filter, sort or projection argument,
+    keeping the type of every value (an ObjectId and its hex string differ).
+    """
+    return json.dumps(argument, sort_keys=True, default=encode_bson_value)
+
+
+class QueryCache(object):
+    """Thread safe LRU cache of query results. max_entries bounds the number of
+    cached queries, default_ttl (seconds, None for no expiry) applies to
+    collections without their own ttl, set with set_ttl.
+    """
+
+    def __init__(self, max_entries=1024, default_ttl=None):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.ttls = {}
+        self.entries = OrderedDict()
+        self.collection_keys = {}
+        self.generations = {}
+        self.epoch = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def set_ttl(self, collection, ttl):
+        """Sets the time to live in seconds of the entries of one collection (a
+        collection object or its full name), on every client.
+        """
+        if not isinstance(collection, str):
+            collection = get_collection_name(collection)
+        self.ttls[collection] = ttl
+
+    def make_key(self, collection, *arguments):
+        return (get_collection_key(collection),) + tuple(normalize_argument(argument)
+                                                         for argument in arguments)
+
+    def get(self, key):
+        """Returns the cached value for key, or None (counting a miss) if there
+        is no current entry.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self.remove(key)
+            self.misses += 1
+            return None
+
+    def get_generation(self, collection_key):
+        """Returns the generation of a collection's entries, which changes when the
+        collection is invalidated or the whole cache is cleared.
+        """
+        return self.epoch, self.generations.get(collection_key, 0)
+
+    def put(self, key, value, generation=None):
+        """Caches a value. If generation (from get_generation) is given and the
+        collection has been invalidated or the cache cleared since it was read,
+        the (possibly stale) value is not cached.
+        """
+        ttl = self.ttls.get(key[0][1], self.default_ttl)
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self.lock:
+            if generation is not None and generation != self.get_generation(key[0]):
+                return
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            self.collection_keys.setdefault(key[0], set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def remove(self, key):
+        self.entries.pop(key, None)
+        keys = self.collection_keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+
+    def get_or_load(self, key, load):
+        """Returns the cached value for key, calling load() and caching its result
+        on a miss.
+        """
+        value = self.get(key)
+        if value is None:
+            generation = self.get_generation(key[0])
+            value = load()
+            self.put(key, value, generation)
+        return value
+
+    def invalidate(self, collection):
+        """Removes every entry of a collection. Given a collection object only its
+        client's entries are removed, given a full name those of every client.
+        """
+        with self.lock:
+            if isinstance(collection, str):
+                collection_keys = [collection_key for collection_key in
+                                   set(self.collection_keys) | set(self.generations)
+                                   if collection_key[1] == collection]
+            else:
+                collection_keys = [get_collection_key(collection)]
+            for collection_key in collection_keys:
+                self.generations[collection_key] = self.generations.get(collection_key, 0) + 1
+                keys = self.collection_keys.pop(collection_key, set())
+                for key in keys:
+                    self.entries.pop(key, None)
+                if keys:
+                    self.invalidations += 1
+
+    def clear(self):
+        """Removes every entry. Values being loaded when the cache is cleared are
+        not cached.
+        """
+        with self.lock:
+            self.epoch += 1
+            self.entries.clear()
+            self.collection_keys.clear()
+
+    def stats(self):
+        """Returns the cache statistics as a dictionary.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self.entries),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+                    'evictions': self.evictions,
+                    'invalidations': self.invalidations}
+
+
+if __name__ == '__main__':
+    print('Please use mongo_cache_utils as method package.')
@@ -0,0 +1,87 @@
+from concurrent.futures import ThreadPoolExecutor
+from pythoncommons import record_reader_utils
+from pythoncommons.mongo_utils import make_spatial_near_argument, make_spatial_within_argument, \
+    mongo_stream_records
+
+"""
+Batched geospatial queries. Many $near (or $geoNear) queries, one per point, or
+$geoWithin queries, one per polygon, run concurrently on the shared client
+connection pool with a bounded number of workers, and the results come back as
+one list of records per input, in input order.
+"""
+
+
+def run_batched(query, arguments, workers=16):
+    """Runs query on each argument on at most workers threads and returns the
+    list of results in argument order. A failed query gives an error string, as
+    mongo_find_records does.
+    """
+    def run(argument):
+        try:
+            return query(argument)
+        except:
+            return "Cannot return the documents for the specified query."
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run, arguments))
+
+
+def make_geo_near_pipeline(key, longitude, latitude, k=None, max_distance=None,
+                           distance_field='distance', projection=None):
+    """Creates and returns a $geoNear aggregation pipeline returning the k (all
+    if None) nearest documents to a point, each with its distance in meters in
+    distance_field.
+    """
+    geo_near = {'near': {'type': 'Point', 'coordinates': [longitude, latitude]},
+                'key': key,
+                'distanceField': distance_field,
+                'spherical': True}
+    if max_distance:
+        geo_near['maxDistance'] = max_distance
+    pipeline = [{'$geoNear': geo_near}]
+    if k:
+        pipeline.append({'$limit': k})
+    if projection:
+        pipeline.append({'$project': dict(projection, **{distance_field: 1})})
+    return pipeline
+
+
+def mongo_find_near_many(collection, key, points, k=None, max_distance=None, workers=16,
+                         named_tuple=False, projection=None, distance_field=None):
+    """Finds the k nearest records (all if None) within max_distance meters of
+    each (longitude, latitude) point, running up to workers $near queries at
+    once. Returns one list of records per point, nearest first, in the order of
+    points. With distance_field set, $geoNear pipelines are used instead and
+    each record carries its distance in that field.
+    """
+    if distance_field:
+        to_record = record_reader_utils.dict_to_named_tuple_closure(collection.name) \
+            if named_tuple else None
+
+        def query(point):
+            records = collection.aggregate(make_geo_near_pipeline(
+                key, point[0], point[1], k, max_distance, distance_field, projection))
+            return list(map(to_record, records)) if to_record else list(records)
+    else:
+        def query(point):
+            return list(mongo_stream_records(
+                collection, make_spatial_near_argument(key, point[0], point[1], max_distance),
+                named_tuple=named_tuple, projection=projection, limit=k or 0))
+    return run_batched(query, points, workers)
+
+
+def mongo_find_within_many(collection, key, polygons, poly_type='Polygon', workers=16,
+                           named_tuple=False, projection=None):
+    """Finds the records within each polygon (coordinates as given to
+    make_spatial_within_argument), running up to workers $geoWithin queries at
+    once. Returns one list of records per polygon, in the order of polygons.
+    """
+    def query(coordinates):
+        return list(mongo_stream_records(
+            collection, make_spatial_within_argument(key, coordinates, poly_type),
+            named_tuple=named_tuple, projection=projection))
+    return run_batched(query, polygons, workers)
+
+
+if __name__ == '__main__':
+    print('Please use mongo_geo_utils as method package.')
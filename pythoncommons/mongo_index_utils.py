@@ -0,0 +1,165 @@
+from pymongo import ASCENDING, GEOSPHERE, IndexModel
+from pythoncommons.mongo_cache_utils import get_collection_name
+
+"""
+Declarative index management for mongo collections. Indexes are described by
+specifications (compound, TTL, partial, unique and 2dsphere indexes), compared
+with the collection's index_information() and only the missing ones are built,
+in the background, so the specifications can be applied on every start. Also
+reports the queries that are answered by a collection scan.
+"""
+
+# globals
+index_options = ['unique', 'sparse', 'expireAfterSeconds', 'partialFilterExpression']
+
+
+def make_index_keys(keys):
+    """Returns the list of (field, direction) pairs of an index from a field name,
+    a list of field names (ascending) or a list of (field, direction) pairs.
+    """
+    if isinstance(keys, str):
+        return [(keys, ASCENDING)]
+    return [(key, ASCENDING) if isinstance(key, str) else (key[0], key[1]) for key in keys]
+
+
+def get_index_name(keys):
+    """Returns mongo's default name for an index on keys, e.g. 'a_1_b_-1'.
+    """
+    return '_'.join('{f}_{d}'.format(f=field, d=direction) for field, direction in keys)
+
+
+def make_index_spec(keys, name=None, unique=False, sparse=False, ttl=None, partial=None):
+    """Creates and returns an index specification. keys is a field name or a list
+    of field names or (field, direction) pairs for a compound index. ttl is the
+    expireAfterSeconds of a TTL index and partial the partialFilterExpression of
+    a partial index.
+    """
+    keys = make_index_keys(keys)
+    options = {}
+    if unique:
+        options['unique'] = True
+    if sparse:
+        options['sparse'] = True
+    if ttl is not None:
+        options['expireAfterSeconds'] = ttl
+    if partial:
+        options['partialFilterExpression'] = partial
+    return {'name': name or get_index_name(keys), 'keys': keys, 'options': options}
+
+
+def make_geosphere_index_spec(field, name=None, partial=None):
+    """Creates and returns the specification of a 2dsphere index on field.
+    """
+    return make_index_spec([(field, GEOSPHERE)], name, partial=partial)
+
+
+def make_ttl_index_spec(field, seconds, name=None):
+    """Creates and returns the specification of a TTL index, expiring documents
+    seconds after the datetime in field.
+    """
+    return make_index_spec(field, name, ttl=seconds)
+
+
+def get_index_options(index_information):
+    """Returns the index_options set in one entry of index_information().
+    """
+    return {option: index_information[option] for option in index_options
+            if option in index_information and index_information[option] is not False}
+
+
+def compare_indexes(collection, specs):
+    """Compares index specifications with the collection's indexes. Returns a
+    dictionary of 'existing' specs, 'missing' specs, and 'conflicts', the specs
+    whose keys are already indexed with different options (or whose name is used
+    by another index), which cannot be created without dropping that index.
+    """
+    current = collection.index_information()
+    current_by_keys = {tuple((field, direction) for field, direction in information['key']): name
+                       for name, information in current.items()}
+    comparison = {'existing': [], 'missing': [], 'conflicts': []}
+    for spec in specs:
+        name = current_by_keys.get(tuple(spec['keys']))
+        if name is None:
+            if spec['name'] in current:
+                comparison['conflicts'].append(dict(spec, current=current[spec['name']]))
+            else:
+                comparison['missing'].append(spec)
+        elif get_index_options(current[name]) != spec['options']:
+            comparison['conflicts'].append(dict(spec, current=current[name]))
+        else:
+            comparison['existing'].append(spec)
+    return comparison
+
+
+def mongo_ensure_indexes(collection, specs):
+    """Creates the indexes of specs the collection is missing, building them in
+    the background. Indexes that already exist are left alone, so this can be
+    called on every start. Returns the compare_indexes dictionary with the names
+    of the indexes created under 'created'.
+    """
+    try:
+        comparison = compare_indexes(collection, specs)
+        comparison['created'] = []
+        if comparison['missing']:
+            comparison['created'] = collection.create_indexes(
+                [IndexModel(spec['keys'], name=spec['name'], background=True, **spec['options'])
+                 for spec in comparison['missing']])
+        return comparison
+    except:
+        return "Cannot create the indexes for the specified collection."
+
+
+def get_plan_stages(plan):
+    """Returns the list of stage names in an explain() plan, walking the nested
+    input stages.
+    """
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        for key in ['inputStage', 'queryPlan', 'winningPlan']:
+            stages += get_plan_stages(plan.get(key))
+        for input_stage in plan.get('inputStages', []):
+            stages += get_plan_stages(input_stage)
+    return stages
+
+
+def find_collection_scans(collection, arguments):
+    """Explains each filter argument (for example from make_single_field_argument
+    or make_spatial_near_argument) and returns a report for those answered by a
+    collection scan, or that cannot run for want of an index (a $near query
+    without a 2dsphere index), with the plan's stages or the error.
+    """
+    report = []
+    for argument in arguments:
+        try:
+            explanation = collection.find(argument).explain()
+            stages = get_plan_stages(explanation.get('queryPlanner', {}).get('winningPlan'))
+            if 'COLLSCAN' in stages:
+                report.append({'collection': get_collection_name(collection),
+                               'argument': argument,
+                               'stages': stages})
+        except Exception as inst:
+            report.append({'collection': get_collection_name(collection),
+                           'argument': argument,
+                           'error': str(inst)})
+    return report
+
+
+def find_profiled_collection_scans(database, collection_name=None, limit=100):
+    """Returns the most recent queries in the database profiler (enabled with
+    database.set_profiling_level or the profile command) that scanned a whole
+    collection, optionally only those on collection_name.
+    """
+    argument = {'planSummary': 'COLLSCAN'}
+    if collection_name:
+        argument['ns'] = '{d}.{c}'.format(d=database.name, c=collection_name)
+    return [{'collection': entry.get('ns'),
+             'argument': entry.get('command', entry.get('query')),
+             'docs_examined': entry.get('docsExamined'),
+             'millis': entry.get('millis')}
+            for entry in database['system.profile'].find(argument).sort('ts', -1).limit(limit)]
+
+
+if __name__ == '__main__':
+    print('Please use mongo_index_utils as method package.')
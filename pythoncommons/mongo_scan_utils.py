@@ -0,0 +1,175 @@
+from bson import ObjectId
+from bson.decimal128 import Decimal128
+from concurrent.futures import ThreadPoolExecutor
+from pythoncommons.mongo_utils import mongo_stream_records
+from pythoncommons.record_reader_utils import chunk_records
+import datetime
+import queue
+import threading
+
+"""
+Parallel scans of large mongo collections. The collection is split into ranges
+of _id (or another indexed field) at split points sampled from the collection,
+and the ranges are read concurrently on the shared client connection pool.
+The results come back either as one merged stream or as one lazy stream per
+range for parallel consumers.
+"""
+
+# globals
+bson_types = [(str, 'string'), (ObjectId, 'objectId'), (datetime.datetime, 'date')]
+
+
+def get_bson_type(value):
+    """Returns the $type alias of the BSON comparison bracket a value belongs to
+    (all numbers compare with each other), or None for unsupported types.
+    """
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, (int, float, Decimal128)):
+        return 'number'
+    for value_types, alias in bson_types:
+        if isinstance(value, value_types):
+            return alias
+    return None
+
+
+def get_sort_key(value):
+    if isinstance(value, Decimal128):
+        return value.to_decimal()
+    return value
+
+
+def get_split_points(collection, partitions, field='_id', argument=None, sample_size=1000):
+    """Returns up to partitions - 1 sorted, distinct values of field that split
+    the matching documents into ranges of roughly equal size, estimated from a
+    random sample of sample_size documents. Since range filters only match values
+    of one BSON type, the split points are all of the type most common in the
+    sample (see make_range_arguments for the documents of other types).
+    """
+    if partitions < 2:
+        return []
+    pipeline = []
+    if argument:
+        pipeline.append({'$match': argument})
+    pipeline += [{'$sample': {'size': sample_size}}, {'$project': {field: 1}}]
+    type_values = {}
+    for document in collection.aggregate(pipeline):
+        value = document.get(field)
+        value_type = get_bson_type(value)
+        if value_type:
+            type_values.setdefault(value_type, []).append(value)
+    if not type_values:
+        return []
+    values = max(type_values.values(), key=len)
+    values = sorted(set(values), key=get_sort_key)
+    split_points = []
+    for partition in range(1, partitions):
+        value = values[partition * len(values) // partitions]
+        if not split_points or get_sort_key(value) > get_sort_key(split_points[-1]):
+            split_points.append(value)
+    return split_points
+
+
+def combine_arguments(argument, range_argument):
+    if argument and range_argument:
+        return {'$and': [argument, range_argument]}
+    return argument or range_argument
+
+
+def make_range_arguments(split_points, field='_id', argument=None):
+    """Returns one filter per range between consecutive split points (the first
+    and last ranges are open ended), each combined with the optional argument.
+    Range filters only match values of the split points' BSON type, so a final
+    filter matches the documents whose field is missing, null or of another
+    type. Documents are assumed to hold a single value (not an array) in field.
+    """
+    bounds = [None] + list(split_points) + [None]
+    arguments = []
+    for lower, upper in zip(bounds[:-1], bounds[1:]):
+        condition = {}
+        if lower is not None:
+            condition['$gte'] = lower
+        if upper is not None:
+            condition['$lt'] = upper
+        arguments.append(combine_arguments(argument, {field: condition} if condition else {}))
+    if split_points:
+        other_types = {field: {'$not': {'$type': get_bson_type(split_points[0])}}}
+        arguments.append(combine_arguments(argument, other_types))
+    return arguments
+
+
+def mongo_partition_streams(collection, argument=None, partitions=4, field='_id',
+                            named_tuple=False, projection=None, batch_size=1000,
+                            sample_size=1000):
+    """Returns a list of lazy record streams, one per range of field, for
+    parallel consumers, plus one for the documents whose field is missing or of
+    another type (see make_range_arguments). Each stream is sorted on field.
+    """
+    split_points = get_split_points(collection, partitions, field, argument, sample_size)
+    return [mongo_stream_records(collection, range_argument, [(field, 1)], named_tuple,
+                                 batch_size, projection)
+            for range_argument in make_range_arguments(split_points, field, argument)]
+
+
+def mongo_parallel_scan(collection, argument=None, partitions=4, field='_id', workers=None,
+                        named_tuple=False, projection=None, batch_size=1000, ordered=False,
+                        sample_size=1000, prefetch=2):
+    """Generator yielding every matching record, reading the ranges of field
+    concurrently on workers threads (default one per range). With ordered=True
+    the records come back sorted on field (documents whose field is missing or
+    of another type than the split points last), otherwise in the order the ranges
+    deliver them. At most prefetch batches per range (ordered) or per worker
+    (unordered) are held waiting for the consumer.
+    """
+    streams = mongo_partition_streams(collection, argument, partitions, field, named_tuple,
+                                      projection, batch_size, sample_size)
+    workers = workers or len(streams)
+    stop = threading.Event()
+    finished = object()
+    if ordered:
+        queues = [queue.Queue(maxsize=prefetch) for _ in streams]
+    else:
+        queues = [queue.Queue(maxsize=prefetch * workers)] * len(streams)
+
+    def put(batch_queue, item):
+        while not stop.is_set():
+            try:
+                batch_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def scan(index):
+        try:
+            for batch in chunk_records(streams[index], batch_size):
+                if not put(queues[index], batch):
+                    return
+            put(queues[index], finished)
+        except BaseException as error:
+            put(queues[index], error)
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for index in range(len(streams)):
+            executor.submit(scan, index)
+        remaining = len(streams)
+        current = 0
+        while remaining:
+            item = queues[current].get()
+            if item is finished:
+                remaining -= 1
+                if ordered:
+                    current += 1
+                continue
+            if isinstance(item, BaseException):
+                raise item
+            for record in item:
+                yield record
+    finally:
+        stop.set()
+        executor.shutdown()
+
+
+if __name__ == '__main__':
+    print('Please use mongo_scan_utils as method package.')
@@ -0,0 +1,271 @@
+from collections import deque
+from functools import wraps
+from pythoncommons.mongo_cache_utils import get_collection_name
+import bisect
+import threading
+import time
+
+"""
+Timing instrumentation for the mongo_utils helpers. Once enabled, each
+instrumented helper call records its latency (in a histogram), document count
+and error count per helper and collection. A find returning a cursor runs its
+query as the cursor is consumed, so the cursor is wrapped and the call is only
+recorded when the cursor is exhausted or closed, its latency being the time
+spent in the call and in fetching the documents (not the caller's own work
+between them). Calls slower than a threshold are kept in a slow query log,
+optionally with the explain() output of the query.
+The statistics can be exported as a dictionary for a metrics agent.
+"""
+
+# globals
+latency_buckets_ms = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+argument_repr_length = 1000
+helper_errors = threading.local()
+
+
+def empty_helper_stats():
+    return {'calls': 0,
+            'errors': 0,
+            'documents': 0,
+            'total_ms': 0.0,
+            'max_ms': 0.0,
+            'histogram': [0] * (len(latency_buckets_ms) + 1)}
+
+
+class MongoStats(object):
+    """Collects the statistics of instrumented helper calls. Disabled until
+    enable() is called. Calls taking at least slow_ms milliseconds are added to
+    a slow query log of at most slow_log_size entries, with the query's explain()
+    output if capture_explain is True.
+    """
+
+    def __init__(self, slow_ms=100, slow_log_size=100, capture_explain=False):
+        self.enabled = False
+        self.slow_ms = slow_ms
+        self.capture_explain = capture_explain
+        self.slow_queries = deque(maxlen=slow_log_size)
+        self.helpers = {}
+        self.lock = threading.Lock()
+
+    def enable(self, slow_ms=None, capture_explain=None):
+        if slow_ms is not None:
+            self.slow_ms = slow_ms
+        if capture_explain is not None:
+            self.capture_explain = capture_explain
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.helpers = {}
+            self.slow_queries.clear()
+
+    def record(self, helper, collection_name, elapsed_ms, documents=0, error=False):
+        with self.lock:
+            stats = self.helpers.setdefault(helper, {}).setdefault(collection_name,
+                                                                    empty_helper_stats())
+            stats['calls'] += 1
+            stats['errors'] += 1 if error else 0
+            stats['documents'] += documents or 0
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+            stats['histogram'][bisect.bisect_left(latency_buckets_ms, elapsed_ms)] += 1
+
+    def record_slow_query(self, helper, collection_name, elapsed_ms, argument=None, explain=None):
+        self.slow_queries.append({'helper': helper,
+                                  'collection': collection_name,
+                                  'elapsed_ms': elapsed_ms,
+                                  'argument': repr(argument)[:argument_repr_length],
+                                  'explain': explain,
+                                  'time': time.time()})
+
+    def as_dict(self):
+        """Returns the statistics as a dictionary of helper -> collection -> stats,
+        with the histogram given as {'<=N': count} (milliseconds), plus the slow
+        query log.
+        """
+        labels = ['<={b}'.format(b=bucket) for bucket in latency_buckets_ms] + \
+            ['>{b}'.format(b=latency_buckets_ms[-1])]
+        with self.lock:
+            helpers = {}
+            for helper, collections in self.helpers.items():
+                helpers[helper] = {}
+                for collection_name, stats in collections.items():
+                    exported = dict(stats)
+                    exported['mean_ms'] = stats['total_ms'] / stats['calls'] if stats['calls'] else 0.0
+                    exported['histogram'] = dict(zip(labels, stats['histogram']))
+                    helpers[helper][collection_name] = exported
+            return {'helpers': helpers, 'slow_queries': list(self.slow_queries)}
+
+
+mongo_stats = MongoStats()
+
+
+def is_string_error(result):
+    return isinstance(result, str)
+
+
+def record_helper_error(error):
+    """Notes an exception swallowed by an instrumented helper, so the call is
+    counted as an error even when its error value is also a valid result (such
+    as the 0 returned by mongo_remove_one).
+    """
+    helper_errors.error = error
+
+
+def count_documents(result):
+    """Returns the number of documents a helper result refers to, when known.
+    """
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    if isinstance(result, bool):
+        return 0
+    if isinstance(result, int):
+        return result
+    for attribute in ['modified_count', 'deleted_count']:
+        count = getattr(result, attribute, None)
+        if isinstance(count, int):
+            return count
+    return 0
+
+
+def count_one(result):
+    return 1
+
+
+def explain_find(collection, argument=None, *args, **kwargs):
+    return collection.find(argument).explain()
+
+
+def is_not_lazy(result):
+    return False
+
+
+def is_lazy_find(result):
+    """Tells whether a mongo_find_records result is a lazy cursor or iterator,
+    whose query only runs as it is consumed.
+    """
+    return not isinstance(result, (list, str))
+
+
+class RecordedCursor(object):
+    """Wraps a lazy helper result (a cursor or iterator) and calls
+    on_done(elapsed_ms, documents, error) once, when it is exhausted, closed or
+    fails. elapsed_ms starts with the helper call's own time and adds the time
+    spent fetching each document. Other attributes are taken from the wrapped
+    cursor, and cursor methods returning the cursor return the wrapper instead.
+    """
+
+    def __init__(self, cursor, elapsed_ms, on_done):
+        self.cursor = cursor
+        self.elapsed_ms = elapsed_ms
+        self.on_done = on_done
+        self.documents = 0
+        self.done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            value = next(self.cursor)
+        except StopIteration:
+            self.elapsed_ms += (time.perf_counter() - start) * 1000.0
+            self.finish()
+            raise
+        except Exception:
+            self.elapsed_ms += (time.perf_counter() - start) * 1000.0
+            self.finish(True)
+            raise
+        self.elapsed_ms += (time.perf_counter() - start) * 1000.0
+        self.documents += 1
+        return value
+
+    def __getitem__(self, index):
+        return self.cursor[index]
+
+    def __getattr__(self, name):
+        attribute = getattr(self.cursor, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            return self if result is self.cursor else result
+        return call
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def finish(self, error=False):
+        if not self.done:
+            self.done = True
+            self.on_done(self.elapsed_ms, self.documents, error)
+
+    def close(self):
+        self.finish()
+        close = getattr(self.cursor, 'close', None)
+        if close:
+            close()
+
+
+def record_call(helper, collection, args, kwargs, elapsed_ms, documents, error, explain):
+    """Records one helper call in mongo_stats, adding it to the slow query log
+    (with its query plan if explain is given and enabled) when it was slow.
+    """
+    try:
+        collection_name = get_collection_name(collection)
+    except:
+        collection_name = repr(collection)
+    mongo_stats.record(helper, collection_name, elapsed_ms, 0 if error else documents, error)
+    if elapsed_ms >= mongo_stats.slow_ms:
+        plan = None
+        if explain and mongo_stats.capture_explain:
+            try:
+                plan = explain(collection, *args, **kwargs)
+            except Exception as inst:
+                plan = {'error': str(inst)}
+        mongo_stats.record_slow_query(helper, collection_name, elapsed_ms,
+                                      args[0] if args else kwargs.get('argument'), plan)
+
+
+def instrument(helper, is_error=is_string_error, count=count_documents, explain=None,
+               is_lazy=is_not_lazy):
+    """Decorator recording a collection helper's calls in mongo_stats. The helper
+    must take the collection as its first argument. is_error tells whether a
+    result is the helper's error value and count how many documents it holds;
+    errors noted with record_helper_error during the call are counted as well.
+    explain, if given, is called with the helper's arguments to capture the query
+    plan of slow calls. A result that is_lazy (a cursor that has not run the
+    query yet) is returned wrapped in a RecordedCursor, and the call is recorded
+    when the cursor is exhausted or closed.
+    """
+    def decorator(function):
+        @wraps(function)
+        def instrumented(collection, *args, **kwargs):
+            if not mongo_stats.enabled:
+                return function(collection, *args, **kwargs)
+            helper_errors.error = None
+            start = time.perf_counter()
+            result = function(collection, *args, **kwargs)
+            elapsed_ms = (time.perf_counter() - start) * 1000.0
+            if is_lazy(result):
+                return RecordedCursor(result, elapsed_ms, lambda lazy_ms, documents, error:
+                                      record_call(helper, collection, args, kwargs, lazy_ms,
+                                                  documents, error, explain))
+            error = helper_errors.error is not None or is_error(result)
+            record_call(helper, collection, args, kwargs, elapsed_ms,
+                        0 if error else count(result), error, explain)
+            return result
+        return instrumented
+    return decorator
+
+
+if __name__ == '__main__':
+    print('Please use mongo_stats_utils as method package.')
@@ -1,8 +1,26 @@
 from pymongo import MongoClient, GEOSPHERE
 from bson.son import SON
 from bson import ObjectId
-from pythoncommons import json_utils
+from bson.codec_options import CodecOptions
+from bson.decimal128 import Decimal128
+from bson.raw_bson import RawBSONDocument
+from decimal import Decimal
 from pythoncommons import record_reader_utils
+from pythoncommons.mongo_cache_utils import QueryCache
+from pythoncommons.mongo_stats_utils import instrument, count_one, explain_find, \
+    is_lazy_find, record_helper_error
+import atexit
+import os
+import threading
+
+# globals
+mongo_client_options = {'maxPoolSize': 100,
+                        'connectTimeoutMS': 20000,
+                        'serverSelectionTimeoutMS': 30000}
+mongo_clients = {}
+mongo_clients_lock = threading.Lock()
+mongo_clients_pid = os.getpid()
+mongo_query_cache = QueryCache()
 
 
 def unload_cursor(cursor):
@@ -14,6 +32,45 @@ def unload_cursor(cursor):
         return "Could not unload the cursor"
 
 
+def decimal_converter(decimal_policy='float'):
+    """Returns the function used to store Decimal values under a decimal policy:
+    'float' (the default, as the json round trip did), 'decimal128' or 'string'.
+    """
+    policy_dictionary = {'float': float, 'decimal128': Decimal128, 'string': str}
+    return policy_dictionary[decimal_policy]
+
+
+def to_document(thing, decimal_policy='float'):
+    """Converts a record into a mongo document directly, walking nested named
+    tuples (which become dictionaries), lists, tuples and dictionaries. Decimals
+    are converted by the decimal policy, while datetimes and other BSON types
+    are kept as they are. No intermediate json string is made.
+    """
+    convert_decimal = decimal_converter(decimal_policy)
+
+    def convert(value):
+        value_type = type(value)
+        if value_type in (str, int, float, bool) or value is None:
+            return value
+        if value_type is dict:
+            return {key if type(key) is str else str(key): convert(item)
+                    for key, item in value.items()}
+        if isinstance(value, tuple):
+            if hasattr(value_type, '_fields'):
+                return {key: convert(item) for key, item in zip(value._fields, value)}
+            return [convert(item) for item in value]
+        if value_type is list:
+            return [convert(item) for item in value]
+        if isinstance(value, Decimal):
+            return convert_decimal(value)
+        if isinstance(value, dict):
+            return {key if type(key) is str else str(key): convert(item)
+                    for key, item in value.items()}
+        return value
+
+    return convert(thing)
+
+
 def ensure_objectid(id_string):
     """Converts a string to a mongo objectId if it isn't, returning the objectId.
     """
@@ -85,16 +142,71 @@ def merge_update_args(update_list):
     return master_update
 
 
-def mongo_get_connection(db_name, connect_string=None):
+def mongo_set_client_options(**options):
+    """Sets the default MongoClient options (for example maxPoolSize,
+    connectTimeoutMS, serverSelectionTimeoutMS) used for clients created after the call.
+    """
+    mongo_client_options.update(options)
+
+
+def reset_mongo_clients():
+    """Forgets the registered clients without closing them. Used in a forked child,
+    where clients inherited from the parent must not be used.
+    """
+    global mongo_clients_lock, mongo_clients_pid
+    mongo_clients_lock = threading.Lock()
+    mongo_clients.clear()
+    mongo_clients_pid = os.getpid()
+
+
+def mongo_get_client(connect_string=None, **options):
+    """Returns the shared MongoClient for the connection string and options,
+    creating it on first use. Clients are kept in a process wide registry so
+    helpers share one connection pool, are recreated in forked children, and
+    are closed when the process exits. Options override mongo_client_options.
+    """
+    if mongo_clients_pid != os.getpid():
+        reset_mongo_clients()
+    client_options = dict(mongo_client_options, **options)
+    key = (connect_string, tuple(sorted(client_options.items())))
+    client = mongo_clients.get(key)
+    if client is None:
+        with mongo_clients_lock:
+            client = mongo_clients.get(key)
+            if client is None:
+                if connect_string:
+                    client = MongoClient(connect_string, **client_options)
+                else:
+                    client = MongoClient(**client_options)
+                mongo_clients[key] = client
+    return client
+
+
+def mongo_close_clients():
+    """Closes every registered client and empties the registry.
+    """
+    with mongo_clients_lock:
+        clients = list(mongo_clients.values())
+        mongo_clients.clear()
+    for client in clients:
+        try:
+            client.close()
+        except:
+            pass
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_mongo_clients)
+atexit.register(mongo_close_clients)
+
+
+def mongo_get_connection(db_name, connect_string=None, **options):
     """ Connects to a specified mongodb database. Optional connection string,
-    otherwise connects on localhost at 27017.
+    otherwise connects on localhost at 27017. The client is shared with other
+    calls using the same connection string and options (see mongo_get_client).
     """
     try:
-        if connect_string:
-            client = MongoClient(connect_string)
-        else:
-            client = MongoClient()
-        return client[db_name]
+        return mongo_get_client(connect_string, **options)[db_name]
     except:
         return "Cannot make mongodb connection with specified parameters."
 
@@ -108,30 +220,36 @@ def mongo_get_collection(connection, collection_name):
         return "Cannot retrieve {c} collection on specified connection.".format(c=collection_name)
 
 
-def mongo_insert_one(collection, record, make_serial=True):
+@instrument('insert_one', count=count_one)
+def mongo_insert_one(collection, record, make_serial=True, decimal_policy='float'):
     """ Inserts a single python object into a given collection. Default is to serialize
-    the object before insert.
+    the object before insert (see to_document).
     """
     try:
         if make_serial:
-            record = json_utils.serialize(record)
+            record = to_document(record, decimal_policy)
         result = collection.insert_one(record)
+        mongo_query_cache.invalidate(collection)
         return result.inserted_id
     except Exception as inst:
         print('Insert failure for {0}'.format(record))
         return "Cannot insert record into specified collection."
 
 
+@instrument('replace_one', is_error=lambda result: result is False)
 def mongo_replace_one(collection, record, argument):
     """ Replaces a single object in the collection.
     """
     try:
-        return collection.replace_one(argument, record)
+        result = collection.replace_one(argument, record)
+        mongo_query_cache.invalidate(collection)
+        return result
     except:
         print('Could not replace record')
         return False
 
 
+@instrument('remove_one')
 def mongo_remove_one(collection, record):
     """ Removes a single specified record from the specified collection, using
     the given record (Argument). For example, the record could be an entire record,
@@ -140,11 +258,14 @@ def mongo_remove_one(collection, record):
     """
     try:
         deletion = collection.delete_one(record)
+        mongo_query_cache.invalidate(collection)
         return deletion.deleted_count
-    except:
+    except Exception as inst:
+        record_helper_error(inst)
         return 0
 
 
+@instrument('remove_many')
 def mongo_remove_many(collection, record):
     """ Removes all documents in the given collection with the given record (argument).
     For example, the record could be an entire record,
@@ -153,66 +274,112 @@ def mongo_remove_many(collection, record):
     """
     try:
         deletion = collection.delete_many(record)
+        mongo_query_cache.invalidate(collection)
         return deletion.deleted_count
-    except:
+    except Exception as inst:
+        record_helper_error(inst)
         return 0
 
 
+@instrument('update_one', is_error=lambda result: result is None)
 def mongo_update_one(collection, argument, update):
     """Updates a single record in the mongodb. Returns the updated record.
     """
     try:
-        return collection.update_one(argument, update, upsert=False)
+        result = collection.update_one(argument, update, upsert=False)
+        mongo_query_cache.invalidate(collection)
+        return result
     except:
         return None
 
 
-def mongo_insert_many(collection, records, make_serial=True):
+@instrument('insert_many')
+def mongo_insert_many(collection, records, make_serial=True, decimal_policy='float'):
     """ Inserts an array of python objects into a given collection. Default is to serialize
-    the objects before insert.
+    the objects before insert (see to_document).
     """
     try:
         if make_serial:
-            result = collection.insert_many(list(map(json_utils.serialize, records)))
+            result = collection.insert_many([to_document(record, decimal_policy)
+                                             for record in records])
         else:
             result = collection.insert_many(records)
+        mongo_query_cache.invalidate(collection)
         return result.inserted_ids
     except:
         return "Cannot insert records into specified collection."
 
 
-def mongo_find_records(collection, argument=None, sort=None, named_tuple=False):
+@instrument('find_records', explain=explain_find, is_lazy=is_lazy_find)
+def mongo_find_records(collection, argument=None, sort=None, named_tuple=False, stream=False,
+                       cache=False, **stream_options):
     """ Finds all the records for the specified collection. Optionally serializes
-    the collection into a list of named tuples (set named_tuple=True)
+    the collection into a list of named tuples (set named_tuple=True). Any of the
+    mongo_stream_records options (batch_size, projection, limit, hint, raw) can be
+    given. Set stream=True to convert the records lazily instead of building a list.
+    Set cache=True to serve the (list of) records from mongo_query_cache, which
+    the mongo_utils write helpers invalidate. Cached records are shared between
+    callers and should not be modified.
     """
     try:
-        if named_tuple:
-            nametuple_maker = record_reader.dict_to_named_tuple_closure(collection.name)
-            if sort:
-                return list(map(nametuple_maker, collection.find(argument).sort(sort)))
-            return list(map(nametuple_maker, collection.find(argument)))
-        else:
-            if sort:
-                return collection.find(argument).sort(sort)
-            return collection.find(argument)
+        if cache and not stream:
+            options = dict(stream_options)
+            options.pop('batch_size', None)
+            key = mongo_query_cache.make_key(collection, argument, sort, named_tuple, options)
+            return mongo_query_cache.get_or_load(key, lambda: list(mongo_stream_records(
+                collection, argument, sort, named_tuple, **stream_options)))
+        records = mongo_stream_records(collection, argument, sort, named_tuple, **stream_options)
+        if named_tuple and not stream:
+            return list(records)
+        return records
     except:
         return "Cannot return the documents for the specified collection."
 
 
+def mongo_stream_records(collection, argument=None, sort=None, named_tuple=False,
+                         batch_size=1000, projection=None, limit=0, hint=None, raw=False):
+    """ Returns a lazy iterator over the matching documents, fetched from the server
+    batch_size documents at a time, so a collection of any size is scanned in
+    constant memory. Supports a projection, a limit (0 for none) and an index hint.
+    With named_tuple=True each document is turned into a named tuple as it is
+    read. With raw=True the documents are returned as RawBSONDocuments, which only
+    decode the fields that are accessed.
+    """
+    if raw:
+        collection = collection.with_options(
+            codec_options=CodecOptions(document_class=RawBSONDocument))
+    cursor = collection.find(argument, projection).batch_size(batch_size)
+    if sort:
+        cursor = cursor.sort(sort)
+    if limit:
+        cursor = cursor.limit(limit)
+    if hint:
+        cursor = cursor.hint(hint)
+    if named_tuple and not raw:
+        return map(record_reader_utils.dict_to_named_tuple_closure(collection.name), cursor)
+    return cursor
+
+
+@instrument('clear_collection')
 def mongo_clear_collection(collection):
     """ Removes all documents from specified collection. Does not delete collection.
     """
     try:
-        return collection.delete_many({})
+        result = collection.delete_many({})
+        mongo_query_cache.invalidate(collection)
+        return result
     except:
         return "Cannot remove all the objects from the collection."
 
 
+@instrument('remove_collection')
 def mongo_remove_collection(collection):
     """ Removes all documents, indeces, and also removes collection itself.
     """
     try:
-        return collection.drop()
+        result = collection.drop()
+        mongo_query_cache.invalidate(collection)
+        return result
     except:
         return "Cannot remove the specified collection."
 
@@ -221,9 +388,9 @@ def mongo_remove_database(database_name, connection_string=None):
     """ Removes the specified database.
     """
     try:
-        connection = mongo_get_connection(database_name, connect_string=connection_string)
-        connection.drop()
-        return connection.drop()
+        result = mongo_get_client(connection_string).drop_database(database_name)
+        mongo_query_cache.clear()
+        return result
     except:
         return "Cannot remove specified database."
 
@@ -0,0 +1,303 @@
+import decimal
+import hashlib
+import json
+import os
+import shutil
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+"""
+An opt-in cache of parsed record files. After a record file is parsed once,
+the parsed values are stored in a binary sidecar (next to the source file or in
+a cache directory) and later reads load the sidecar instead of parsing the text.
+A sidecar is named by the source file name and a hash of the parse description
+(schema, slices, filters), and records the source size and modification time, so
+a sidecar whose source has changed is rebuilt automatically. Sidecars hold typed
+.npy columns (never pickles), which are memory mapped when read, and a sidecar
+whose description or files are missing is rebuilt.
+"""
+
+# globals
+column_kinds = {bool: ('bool', bool, False),
+                int: ('int', 'int64', 0),
+                float: ('float', 'float64', 0.0),
+                str: ('str', str, ''),
+                decimal.Decimal: ('decimal', str, decimal.Decimal(0))}
+
+
+def get_schema_hash(description):
+    """Returns a short hash of a json serializable parse description.
+    """
+    text = json.dumps(description, sort_keys=True, default=repr)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def get_source_stamp(record_file):
+    """Returns the identity of the source file used to detect stale sidecars.
+    """
+    stat = os.stat(record_file)
+    return [os.path.abspath(record_file), stat.st_size, stat.st_mtime_ns]
+
+
+def get_cache_path(record_file, description, suffix, cache_directory=None):
+    """Returns the sidecar path for a record file and parse description.
+    """
+    directory = cache_directory or os.path.dirname(os.path.abspath(record_file))
+    name = '.{n}.{h}.{s}'.format(n=os.path.basename(record_file),
+                                 h=get_schema_hash(description), s=suffix)
+    return os.path.join(directory, name)
+
+
+def encode_column(values):
+    """Encodes a list of Python values as a typed numpy array for a sidecar.
+    Returns (kind, array, mask), where mask marks the None values (or is None if
+    there are none), or None if the values are not all of one supported type
+    (bool, int, float, str or Decimal).
+    """
+    present = [value for value in values if value is not None]
+    mask = numpy.array([value is None for value in values]) if len(present) < len(values) \
+        else None
+    value_types = set(type(value) for value in present)
+    if not value_types:
+        return 'none', numpy.zeros(len(values), dtype=bool), None
+    if len(value_types) > 1 or value_types.pop() not in column_kinds:
+        return None
+    kind, dtype, empty = column_kinds[type(present[0])]
+    filled = [empty if value is None else value for value in values]
+    if kind == 'decimal':
+        filled = [str(value) for value in filled]
+    try:
+        return kind, numpy.array(filled, dtype=dtype), mask
+    except OverflowError:
+        return None
+
+
+def decode_column(kind, array, mask):
+    """Decodes a column written by encode_column back into a list of Python values.
+    """
+    if kind == 'none':
+        return [None] * len(array)
+    values = array.tolist()
+    if kind == 'decimal':
+        values = [decimal.Decimal(value) for value in values]
+    if mask is not None:
+        values = [None if missing else value for value, missing in zip(values, mask.tolist())]
+    return values
+
+
+def save_column(directory, name, kind, array, mask):
+    """Saves an encoded column (and its mask) as .npy files without pickling.
+    Returns the column's description for the sidecar's source.json.
+    """
+    numpy.save(os.path.join(directory, name + '.npy'), array, allow_pickle=False)
+    if mask is not None:
+        numpy.save(os.path.join(directory, name + '.mask.npy'), mask, allow_pickle=False)
+    return {'kind': kind, 'mask': mask is not None}
+
+
+def load_column(directory, name, column):
+    """Memory maps a saved column. Returns (kind, array, mask).
+    """
+    array = numpy.load(os.path.join(directory, name + '.npy'), mmap_mode='r',
+                       allow_pickle=False)
+    mask = None
+    if column['mask']:
+        mask = numpy.load(os.path.join(directory, name + '.mask.npy'), mmap_mode='r',
+                          allow_pickle=False)
+    return column['kind'], array, mask
+
+
+def read_cache_source(cache_path, stamp):
+    """Returns the source.json of a sidecar, or None if it is missing, unreadable
+    or stale.
+    """
+    try:
+        with open(os.path.join(cache_path, 'source.json'), 'rt') as source_file:
+            source = json.load(source_file)
+    except Exception:
+        return None
+    if source.get('source') != stamp:
+        return None
+    return source
+
+
+def make_temporary_path(cache_path):
+    temporary_path = '{c}.{p}.tmp'.format(c=cache_path, p=os.getpid())
+    shutil.rmtree(temporary_path, ignore_errors=True)
+    os.makedirs(temporary_path)
+    return temporary_path
+
+
+def replace_sidecar(temporary_path, source, cache_path):
+    """Writes source.json and moves a completed sidecar directory into place.
+    """
+    with open(os.path.join(temporary_path, 'source.json'), 'wt') as source_file:
+        json.dump(source, source_file)
+    if os.path.isdir(cache_path):
+        shutil.rmtree(cache_path, ignore_errors=True)
+    elif os.path.exists(cache_path):
+        os.remove(cache_path)
+    os.rename(temporary_path, cache_path)
+
+
+def save_chunk(directory, chunk_index, rows):
+    """Saves a chunk of value tuples as one encoded column per field. Returns the
+    chunk's description, or None if a column cannot be encoded.
+    """
+    columns = []
+    for index, values in enumerate(zip(*rows)):
+        encoded = encode_column(list(values))
+        if encoded is None:
+            return None
+        columns.append(save_column(directory, '{c}_{i}'.format(c=chunk_index, i=index),
+                                   *encoded))
+    return {'length': len(rows), 'columns': columns}
+
+
+def has_chunks(cache_path, source):
+    """Tells whether a record sidecar's source.json lists its chunks and every
+    column file it names is present, without opening them.
+    """
+    try:
+        for chunk_index, chunk in enumerate(source['chunks']):
+            for index, column in enumerate(chunk['columns']):
+                name = os.path.join(cache_path, '{c}_{i}'.format(c=chunk_index, i=index))
+                if not os.path.isfile(name + '.npy') or \
+                        (column['mask'] and not os.path.isfile(name + '.mask.npy')):
+                    return False
+        return True
+    except (KeyError, TypeError):
+        return False
+
+
+def iter_chunk_values(cache_path, source):
+    """Generator yielding the value tuples of a record sidecar. Each chunk is only
+    loaded when it is reached, and each of its columns is memory mapped just long
+    enough to be decoded, so one file is open at a time.
+    """
+    for chunk_index, chunk in enumerate(source['chunks']):
+        columns = [decode_column(*load_column(cache_path,
+                                              '{c}_{i}'.format(c=chunk_index, i=index), column))
+                   for index, column in enumerate(chunk['columns'])]
+        for values in zip(*columns):
+            yield values
+
+
+def iter_cached_values(record_file, description, iter_values, cache_directory=None,
+                       chunk_size=65536):
+    """Generator yielding the parsed value tuples of a record file. If there is a
+    current sidecar for this file and description, its columns are memory mapped
+    and decoded a chunk at a time (an error reading a listed chunk is raised, as
+    values have already been yielded). Otherwise the values come from
+    iter_values(record_file) and are saved, chunk_size rows at a time, as typed
+    .npy columns for the next read. Files whose values cannot be stored as typed
+    columns are not cached.
+    """
+    if numpy is None:
+        raise ImportError('numpy is required for record caching.')
+    stamp = get_source_stamp(record_file)
+    cache_path = get_cache_path(record_file, description, 'records', cache_directory)
+    source = read_cache_source(cache_path, stamp)
+    if source is not None and has_chunks(cache_path, source):
+        for values in iter_chunk_values(cache_path, source):
+            yield values
+        return
+    temporary_path = make_temporary_path(cache_path)
+    try:
+        saved_chunks = []
+        rows = []
+        for values in iter_values(record_file):
+            yield values
+            if saved_chunks is None:
+                continue
+            rows.append(values)
+            if len(rows) >= chunk_size:
+                chunk = save_chunk(temporary_path, len(saved_chunks), rows)
+                saved_chunks = saved_chunks + [chunk] if chunk else None
+                rows = []
+        if saved_chunks is not None and rows:
+            chunk = save_chunk(temporary_path, len(saved_chunks), rows)
+            saved_chunks = saved_chunks + [chunk] if chunk else None
+        if saved_chunks is not None:
+            replace_sidecar(temporary_path, {'source': stamp, 'chunks': saved_chunks},
+                            cache_path)
+    finally:
+        shutil.rmtree(temporary_path, ignore_errors=True)
+
+
+def read_cached_columns(cache_path, stamp):
+    """Returns the cached column dictionary, or None if the sidecar is missing,
+    stale or cannot be loaded. Typed columns are memory mapped.
+    """
+    source = read_cache_source(cache_path, stamp)
+    if source is None:
+        return None
+    try:
+        columns = {}
+        for index, field_name in enumerate(source['field_names']):
+            kind, array, mask = load_column(cache_path, str(index), source['columns'][index])
+            if kind != 'array':
+                array = numpy.array(decode_column(kind, array, mask), dtype=object)
+            columns[field_name] = array
+        return columns
+    except Exception:
+        return None
+
+
+def get_cached_columns(record_file, description, read_columns, cache_directory=None):
+    """Returns the numpy column dictionary of a record file, memory mapped from
+    its columnar sidecar, calling read_columns(record_file) and saving one .npy
+    file per column when there is no current sidecar. Object columns are saved
+    encoded as typed arrays (see encode_column), and a file with an object
+    column that cannot be encoded is not cached.
+    """
+    if numpy is None:
+        raise ImportError('numpy is required for columnar record caching.')
+    stamp = get_source_stamp(record_file)
+    cache_path = get_cache_path(record_file, description, 'columns', cache_directory)
+    columns = read_cached_columns(cache_path, stamp)
+    if columns is not None:
+        return columns
+    columns = read_columns(record_file)
+    temporary_path = make_temporary_path(cache_path)
+    try:
+        field_names = list(columns.keys())
+        saved_columns = []
+        for index, field_name in enumerate(field_names):
+            array = columns[field_name]
+            if array.dtype.hasobject:
+                encoded = encode_column(array.tolist())
+                if encoded is None:
+                    return columns
+            else:
+                encoded = ('array', array, None)
+            saved_columns.append(save_column(temporary_path, str(index), *encoded))
+        replace_sidecar(temporary_path, {'source': stamp, 'field_names': field_names,
+                                         'columns': saved_columns}, cache_path)
+    finally:
+        shutil.rmtree(temporary_path, ignore_errors=True)
+    return columns
+
+
+def clear_cache(record_file, cache_directory=None):
+    """Removes every sidecar of the record file. Returns the number removed.
+    """
+    directory = cache_directory or os.path.dirname(os.path.abspath(record_file))
+    prefix = '.{n}.'.format(n=os.path.basename(record_file))
+    removed = 0
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith(('.records', '.columns')):
+            path = os.path.join(directory, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            removed += 1
+    return removed
+
+
+if __name__ == '__main__':
+    print('Please use record_cache_utils as method package.')
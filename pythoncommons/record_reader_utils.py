@@ -1,10 +1,23 @@
-from collections import namedtuple
 from pythoncommons.property_reader_utils import make_dictionary
-from pythoncommons.general_utils import translate_delimiter
+from pythoncommons.general_utils import translate_delimiter, get_named_tuple_type
 from pythoncommons.directory_utils import get_matching_files
+from pythoncommons.compression_utils import open_file, is_compressed
+from pythoncommons.record_cache_utils import iter_cached_values, get_cached_columns
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import csv
 import decimal
+import io
+import json
+import operator
+import os
+import queue
 import sys
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 """
 The set of tools used for interaction with metadata files.
@@ -14,26 +27,93 @@ metadata file, and create a new metadata file from that station list.
 """
 
 
+def parse_decimal(value):
+    """Parses a decimal string exactly. The global decimal context is not touched,
+    so this is safe to call from several threads at once.
+    """
+    return decimal.Decimal(value)
+
+
+def decimal_quantizer(scale):
+    """Closure function for parsing decimal strings rounded to a fixed number of
+    decimal places (half even). The quantizer and context are built once per column.
+    """
+    quantizer = decimal.Decimal(1).scaleb(-scale)
+    context = decimal.Context(prec=decimal.MAX_PREC, rounding=decimal.ROUND_HALF_EVEN)
+
+    def parse_quantized(value):
+        return decimal.Decimal(value).quantize(quantizer, context=context)
+
+    return parse_quantized
+
+
+def fixed_point_parser(scale):
+    """Closure function for parsing decimal strings into scaled integers, e.g.
+    '12.345' at scale 2 becomes 1235 (rounded half up). No Decimal objects are
+    created, so the values can be summed and compared as plain integers. Blank
+    values raise ValueError, so they become None like the other types.
+    """
+    def parse_fixed_point(value):
+        value = value.strip()
+        negative = value.startswith('-')
+        whole, _, fraction = value.lstrip('+-').partition('.')
+        if not whole and not fraction:
+            raise ValueError('No digits in fixed point value {v!r}'.format(v=value))
+        scaled = int((whole or '0') + fraction[:scale].ljust(scale, '0'))
+        if fraction[scale:scale + 1] >= '5':
+            scaled += 1
+        return -scaled if negative else scaled
+
+    return parse_fixed_point
+
+
+def scaled_integer_to_decimal(value, scale):
+    """Converts a scaled integer produced by a fixed point field back into a Decimal.
+    """
+    return decimal.Decimal(value).scaleb(-scale)
+
+
+def split_field_type(field_type):
+    """Splits a parameterized field type such as 'decimal:2' or 'fixed:2' into the
+    base type and its integer scale. Returns a scale of None for plain types.
+    """
+    base_type, _, scale = field_type.partition(':')
+    if scale:
+        return base_type, int(scale)
+    return base_type, None
+
+
+def unknown_type(value):
+    return None
+
+
+def get_type_converter(field_type):
+    """Returns the function used to convert a raw string value into the given
+    field type (integer, float, decimal, string or list). 'decimal:N' rounds
+    decimals to N places and 'fixed:N' returns integers scaled by 10^N ('fixed'
+    alone is scale 0, as in the columnar reader).
+    """
+    type_dictionary = {"integer": int, "float": float, "string": str, "list": list,
+                       "decimal": parse_decimal}
+    base_type, scale = split_field_type(field_type)
+    if base_type == 'fixed':
+        return fixed_point_parser(scale or 0)
+    if scale is not None and base_type == 'decimal':
+        return decimal_quantizer(scale)
+    return type_dictionary.get(field_type, unknown_type)
+
+
 def type_changer(fields):
     """Closure function for changing an objects type
     """
-    type_dictionary = {"integer": int, "float": float, "string": str, "list": list}
-
     def parse_input(value, field_type):
-        if field_type == "decimal":
-            try:
-                decimal.getcontext().prec = len(value.split(".")[1])
-            except:
-                decimal.getcontext().prec = 4
-            return decimal.Decimal(value)
-        else:
-            return type_dictionary[field_type](value)
+        return get_type_converter(field_type)(value)
 
     return parse_input
 
 
 def make_named_tuple(name, argument_list):
-    return namedtuple(name, argument_list)
+    return get_named_tuple_type(name, tuple(argument_list))
 
 
 def dictionary_converter_tool(named_tuple):
@@ -57,38 +137,365 @@ def record_dictionary(fields):
             return None
 
     def make_record_dictionary(record):
-        return {field[0]: get_value(record, fields.index(field), field[1]) for field in fields}
+        return {field[0]: get_value(record, index, field[1])
+                for index, field in enumerate(fields)}
     return make_record_dictionary
 
 
-def read_records_from_directory(type_name, fields, records_extension, records_directory,
-                                slices=[], field_separator=None, keyword_converter=None):
+def get_record_files(records_extension, records_directory):
+    """Returns the list of record files in the records directory that end with
+    the records extension.
+    """
     properties = {"source_path": [records_directory],
                   "ends_with": [records_extension]}
-    record_files = get_matching_files(properties)
-    records = []
+    return get_matching_files(properties)
+
+
+def make_operator(operator_name):
+    """Returns the comparison function for a where= operator name.
+    """
+    operator_dictionary = {"==": operator.eq, "!=": operator.ne, "<": operator.lt,
+                           "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+                           "in": lambda value, target: value in target,
+                           "not_in": lambda value, target: value not in target,
+                           "contains": operator.contains,
+                           "startswith": lambda value, target: value.startswith(target)}
+    return operator_dictionary[operator_name]
+
+
+class RecordSchema(object):
+    """Parser compiled once from a list of field tuples as (field_name, field_type)
+    and either a list of slices (fixed width records) or a field separator.
+    Column converters and the named tuple type are looked up a single time, so
+    each raw line is turned straight into a record.
+    Optionally takes where, a list of (field_name, operator, value) filters that
+    are tested on the raw value of just those fields before the rest of the row is
+    converted, and columns, a list of field names to decode (the record type then
+    only has those fields).
+    """
+
+    def __init__(self, type_name, fields, slices=None, field_separator=None, where=None,
+                 columns=None):
+        all_fields = list(fields)
+        all_names = [field[0] for field in all_fields]
+        self.indices = [all_names.index(column) for column in columns] if columns else None
+        selected = self.indices if self.indices else range(len(all_fields))
+        self.type_name = type_name
+        self.fields = [all_fields[index] for index in selected]
+        self.field_names = tuple(field[0] for field in self.fields)
+        self.converters = tuple(get_type_converter(field[1]) for field in self.fields)
+        self.named_tuple = make_named_tuple(type_name, self.field_names)
+        self.all_slices = list(slices) if slices else None
+        self.slices = [self.all_slices[index] for index in selected] if slices else None
+        self.field_separator = field_separator
+        self.filters = []
+        if where and isinstance(where[0], str):
+            where = [where]
+        for field_name, operator_name, value in where or []:
+            index = all_names.index(field_name)
+            self.filters.append((index, get_type_converter(all_fields[index][1]),
+                                 make_operator(operator_name), value))
+
+    def split(self, line):
+        """Splits a raw fixed width line into its stripped string values.
+        """
+        return [line[interval].strip() for interval in self.slices]
+
+    def select(self, row):
+        """Picks the projected columns out of a full delimited row.
+        """
+        if self.indices:
+            return [row[index] if index < len(row) else '' for index in self.indices]
+        return row
+
+    def accept(self, raw):
+        """Tests the where filters against a raw fixed width line or delimited row,
+        converting only the filtered fields. Unconvertible values are rejected.
+        """
+        for index, converter, test, target in self.filters:
+            try:
+                if self.all_slices:
+                    value = converter(raw[self.all_slices[index]].strip())
+                else:
+                    value = converter(raw[index])
+                if not test(value, target):
+                    return False
+            except:
+                return False
+        return True
+
+    def convert(self, row):
+        """Converts a list of raw string values into a list of typed values.
+        Values that cannot be converted, or are missing, become None.
+        """
+        values = []
+        for converter, value in zip(self.converters, row):
+            try:
+                values.append(converter(value))
+            except:
+                values.append(None)
+        if len(values) < len(self.converters):
+            values.extend([None] * (len(self.converters) - len(values)))
+        return values
+
+    def make_record(self, row, keyword_converter=None):
+        """Turns a list of raw string values into a named tuple record. If a
+        keyword converter is given it is applied to the record dictionary first.
+        """
+        values = self.convert(row)
+        if keyword_converter:
+            return self.named_tuple(**keyword_converter(dict(zip(self.field_names, values))))
+        return self.named_tuple(*values)
+
+    def parse(self, line, keyword_converter=None):
+        """Turns a single raw fixed width line into a named tuple record.
+        """
+        return self.make_record(self.split(line), keyword_converter)
+
+    def rows(self, lines):
+        """Returns an iterator of raw string value lists for the given lines,
+        skipping the lines rejected by the where filters.
+        """
+        if self.slices:
+            raw_rows = lines
+            split = self.split
+        else:
+            raw_rows = csv.reader(lines, delimiter=self.field_separator)
+            split = self.select
+        if self.filters:
+            raw_rows = filter(self.accept, raw_rows)
+        return map(split, raw_rows)
+
+    def records(self, lines, keyword_converter=None):
+        """Generator yielding a named tuple record for each of the given lines.
+        """
+        make_record = self.make_record
+        for row in self.rows(lines):
+            yield make_record(row, keyword_converter)
+
+
+def read_records_from_directory(type_name, fields, records_extension, records_directory,
+                                slices=[], field_separator=None, keyword_converter=None,
+                                workers=None, ordered=True, chunk_size=None,
+                                checkpoint_file=None, where=None, columns=None):
+    return list(iter_records_from_directory(type_name, fields, records_extension,
+                                            records_directory, slices, field_separator,
+                                            keyword_converter, workers, ordered, chunk_size,
+                                            checkpoint_file, where, columns))
+
+
+def iter_records_from_directory(type_name, fields, records_extension, records_directory,
+                                slices=[], field_separator=None, keyword_converter=None,
+                                workers=None, ordered=True, chunk_size=None,
+                                checkpoint_file=None, where=None, columns=None):
+    """Generator version of read_records_from_directory. Yields the records of each
+    matching file in turn, one record at a time, so only a single record is held in
+    memory at once. If workers is given, the files (or chunk_size byte chunks of them)
+    are parsed across a pool of that many processes instead - see iter_records_parallel.
+    If a checkpoint file is given, only records appended since the last run are read
+    (in the calling process) - see iter_records_resumable. where and columns
+    filter and project the records as described in RecordSchema.
+    """
+    record_files = get_record_files(records_extension, records_directory)
+    if checkpoint_file:
+        for record in iter_records_resumable(type_name, fields, record_files, checkpoint_file,
+                                             slices, field_separator, keyword_converter,
+                                             where, columns):
+            yield record
+        return
+    if workers:
+        for record in iter_records_parallel(type_name, fields, record_files, slices,
+                                            field_separator, keyword_converter, workers,
+                                            ordered, chunk_size, where, columns):
+            yield record
+        return
     for record_file in record_files:
-        records += read_records(type_name, fields, record_file, slices,
-                                field_separator, keyword_converter)
-    return records
+        for record in iter_records(type_name, fields, record_file, slices,
+                                   field_separator, keyword_converter, where, columns):
+            yield record
+
+
+def read_checkpoints(checkpoint_file):
+    """Reads the per file checkpoints saved by iter_records_resumable. Returns an
+    empty dictionary if the checkpoint file does not exist or cannot be read.
+    """
+    try:
+        with open(checkpoint_file, 'rt') as checkpoints:
+            return json.load(checkpoints)
+    except (IOError, ValueError):
+        return {}
+
+
+def write_checkpoints(checkpoint_file, checkpoints):
+    """Saves the per file checkpoints, replacing the checkpoint file atomically.
+    """
+    temporary_file = checkpoint_file + '.tmp'
+    with open(temporary_file, 'wt') as temporary:
+        json.dump(checkpoints, temporary, indent=1, sort_keys=True)
+    os.replace(temporary_file, checkpoint_file)
+
+
+def get_file_head(record_file, length=64):
+    """Returns the first length bytes of the file as a hex string, used to
+    recognize a file that was replaced under the same name. Only bytes that were
+    already consumed are fingerprinted, since later bytes may still be appended.
+    """
+    with open(record_file, 'rb') as records:
+        return records.read(length).hex()
+
+
+def get_resume_offset(record_file, checkpoint):
+    """Returns the byte offset to resume reading the record file from. Returns 0
+    (read from the start) if there is no checkpoint, or if the file was truncated
+    or rotated since the checkpoint was taken.
+    """
+    if not checkpoint:
+        return 0
+    stat = os.stat(record_file)
+    if stat.st_ino != checkpoint.get('inode') or stat.st_dev != checkpoint.get('device'):
+        return 0
+    if stat.st_size < checkpoint.get('offset', 0):
+        return 0
+    head = checkpoint.get('head', '')
+    if get_file_head(record_file, len(head) // 2) != head:
+        return 0
+    return checkpoint.get('offset', 0)
+
+
+def iter_complete_lines(record_file, offset, position):
+    """Generator yielding the complete (newline terminated) text lines of the file
+    starting at the byte offset. A partially written last line is left for the next
+    run. The end offset of each line is stored in position['offset'].
+    """
+    position['offset'] = offset
+    with open(record_file, 'rb') as records:
+        records.seek(offset)
+        for line in records:
+            if not line.endswith(b'\n'):
+                return
+            position['offset'] += len(line)
+            text = line.decode()
+            if text.endswith('\r\n'):
+                text = text[:-2] + '\n'
+            yield text
+
+
+def iter_records_resumable(type_name, fields, record_files, checkpoint_file, slices=[],
+                           field_separator=None, keyword_converter=None, where=None,
+                           columns=None):
+    """Reads only the records appended to the record files since the last run.
+    The consumed byte offset and identity (inode, device, leading bytes) of each
+    file are kept in the checkpoint file, which is saved after each file has been
+    fully consumed. A truncated or rotated file is read again from the start. If
+    the consumer stops part way through a file, that file's new records are read
+    again on the next run. Compressed files have no usable byte offsets and are
+    rejected with a ValueError.
+    """
+    compressed_files = [record_file for record_file in record_files
+                        if is_compressed(record_file)]
+    if compressed_files:
+        raise ValueError('Checkpointed reading does not support compressed files: '
+                         '{f}'.format(f=', '.join(compressed_files)))
+    schema = RecordSchema(type_name, fields, slices, field_separator, where, columns)
+    checkpoints = read_checkpoints(checkpoint_file)
+    for record_file in record_files:
+        key = os.path.abspath(record_file)
+        position = {}
+        offset = get_resume_offset(record_file, checkpoints.get(key))
+        lines = iter_complete_lines(record_file, offset, position)
+        for record in schema.records(lines, keyword_converter):
+            yield record
+        stat = os.stat(record_file)
+        offset = position.get('offset', offset)
+        checkpoints[key] = {'offset': offset,
+                            'inode': stat.st_ino,
+                            'device': stat.st_dev,
+                            'head': get_file_head(record_file, min(offset, 64))}
+        write_checkpoints(checkpoint_file, checkpoints)
+
+
+def get_file_chunks(record_file, chunk_size=None):
+    """Splits a record file into (start, end) byte ranges of roughly chunk_size bytes,
+    each ending on a line boundary. Returns a single (None, None) range, meaning the
+    whole file, if no chunk size is given, the file is smaller than it, or the
+    file is compressed.
+    """
+    file_size = os.path.getsize(record_file)
+    if not chunk_size or file_size <= chunk_size or is_compressed(record_file):
+        return [(None, None)]
+    chunks = []
+    with open(record_file, 'rb') as records:
+        start = 0
+        while start < file_size:
+            records.seek(start + chunk_size)
+            records.readline()
+            end = min(records.tell(), file_size)
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def read_record_chunk(task):
+    """Worker function for iter_records_parallel. Parses one byte range of a record
+    file and returns the records as plain tuples, since the named tuple type built in
+    the worker process cannot be pickled back to the parent.
+    """
+    (type_name, fields, record_file, slices, field_separator, keyword_converter, where,
+     columns, start, end) = task
+    schema = RecordSchema(type_name, fields, slices, field_separator, where, columns)
+    if start is None:
+        with open_file(record_file, 'rt') as records:
+            return [tuple(record) for record in schema.records(records, keyword_converter)]
+    with open(record_file, 'rb') as records:
+        records.seek(start)
+        chunk = io.TextIOWrapper(io.BytesIO(records.read(end - start)))
+    return [tuple(record) for record in schema.records(chunk, keyword_converter)]
+
+
+def iter_records_parallel(type_name, fields, record_files, slices=[], field_separator=None,
+                          keyword_converter=None, workers=None, ordered=True, chunk_size=None,
+                          where=None, columns=None):
+    """Parses the given record files across a process pool of the given number of
+    workers, yielding named tuple records. Each file is one task unless chunk_size
+    is given, in which case files larger than chunk_size bytes are split into line
+    aligned byte ranges (not safe for delimited files with quoted newlines).
+    If ordered is True, records come back in file order, otherwise in the order
+    the tasks finish. The keyword converter must be picklable (a module level function).
+    """
+    named_tuple = RecordSchema(type_name, fields, slices, field_separator, where,
+                               columns).named_tuple
+    tasks = [(type_name, fields, record_file, slices, field_separator, keyword_converter,
+              where, columns, start, end)
+             for record_file in record_files
+             for start, end in get_file_chunks(record_file, chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        if ordered:
+            results = executor.map(read_record_chunk, tasks)
+        else:
+            futures = [executor.submit(read_record_chunk, task) for task in tasks]
+            results = (future.result() for future in as_completed(futures))
+        for result in results:
+            for values in result:
+                yield named_tuple._make(values)
 
 
 def read_records(type_name, fields, record_file, slices=[], field_separator=None,
-                 keyword_converter=None):
-    dictionary_maker = record_dictionary(fields)
-    named_tuple = make_named_tuple(type_name, list(zip(*fields))[0])
-    dictionary_converter = dictionary_converter_tool(named_tuple)
-    with open(record_file, 'rt') as records:
-        if slices:
-            record_slicer = slicer(slices)
-            sliced_records = list(map(record_slicer, records))
-        elif field_separator:
-            sliced_records = [record for record in csv.reader(records, delimiter=field_separator)]
-    dictionary_list = list(map(dictionary_maker, sliced_records))
-    if keyword_converter:
-        dictionary_list = [keyword_converter(dictionary) for dictionary in dictionary_list]
-    named_tuples = list(map(dictionary_converter, dictionary_list))
-    return named_tuples
+                 keyword_converter=None, where=None, columns=None):
+    return list(iter_records(type_name, fields, record_file, slices, field_separator,
+                             keyword_converter, where, columns))
+
+
+def iter_records(type_name, fields, record_file, slices=[], field_separator=None,
+                 keyword_converter=None, where=None, columns=None):
+    """Generator version of read_records. Reads the record file line by line and
+    yields one named tuple per line instead of building the full list of records.
+    where and columns filter and project the records as described in RecordSchema.
+    Compressed (.gz, .bz2, .xz) files are decompressed on a background thread.
+    """
+    schema = RecordSchema(type_name, fields, slices, field_separator, where, columns)
+    with open_file(record_file, 'rt', background=True) as records:
+        for record in schema.records(records, keyword_converter):
+            yield record
 
 
 def make_intervals(positions):
@@ -122,13 +529,257 @@ def make_tuple_dictionary(tuple_list):
 def dict_to_named_tuple_closure(name):
     def dict_to_named_tuple(dictionary):
         dictionary.pop("_id", None)
-        return namedtuple(name, list(dictionary.keys()))(**dictionary)
+        return get_named_tuple_type(name, tuple(dictionary.keys()))(**dictionary)
     return dict_to_named_tuple
 
 
-def get_records_as_tuples(properties, source='property_file'):
+def get_numpy_type(field_type, width=None):
+    """Returns the numpy dtype used for a field type in columnar output. Decimals
+    are stored as float64, fixed point values as int64, and strings as fixed width
+    unicode when the width is known.
+    """
+    field_type = split_field_type(field_type)[0]
+    if field_type in ['integer', 'fixed']:
+        return numpy.dtype(numpy.int64)
+    if field_type in ['float', 'decimal']:
+        return numpy.dtype(numpy.float64)
+    if field_type == 'string' and width:
+        return numpy.dtype('U{w}'.format(w=max(width, 1)))
+    return numpy.dtype(object)
+
+
+def make_line_matrix(data):
+    """Turns the raw bytes of a fixed width record file into a two dimensional
+    uint8 array with one row per line. Files whose lines all have the same length
+    are viewed in place, otherwise the lines are padded to the longest line.
+    Returns the matrix and the usable line width (excluding the line ending).
+    """
+    first_line_end = data.find(b'\n')
+    if first_line_end >= 0:
+        line_length = first_line_end + 1
+        ending = 2 if data[first_line_end - 1:first_line_end] == b'\r' else 1
+        if len(data) % line_length == 0:
+            matrix = numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1, line_length)
+            if (matrix[:, -1] == ord('\n')).all():
+                return matrix, line_length - ending
+    lines = data.splitlines()
+    width = max([len(line) for line in lines] + [1])
+    padded = numpy.array(lines, dtype='S{w}'.format(w=width))
+    return padded.view(numpy.uint8).reshape(len(lines), width), width
+
+
+def parse_numeric_column(column, numpy_type):
+    """Vectorized conversion of a stripped bytes column into a numeric array. Blank
+    or unparseable values become nan, which turns an integer column into float64.
+    """
+    try:
+        return column.astype(numpy_type)
+    except ValueError:
+        values = []
+        for value in column:
+            try:
+                values.append(float(value))
+            except ValueError:
+                values.append(numpy.nan)
+        return numpy.array(values, dtype=numpy.float64)
+
+
+def parse_fixed_point_column(column, scale):
+    """Vectorized conversion of a stripped bytes column into integers scaled by
+    10^scale. Stays float64 (with nan) if the column has blank values.
+    """
+    values = numpy.rint(parse_numeric_column(column, numpy.float64) * 10 ** scale)
+    if numpy.isnan(values).any():
+        return values
+    return values.astype(numpy.int64)
+
+
+def read_fixed_width_columns(fields, record_file, start_positions):
+    """Reads a fixed width record file into a dictionary of numpy column arrays,
+    slicing each column out of the whole file buffer at once.
+    """
+    with open_file(record_file, 'rb') as records:
+        data = records.read()
+    matrix, line_width = make_line_matrix(data)
+    starts = strings_to_ints(start_positions)
+    ends = starts[1:] + [line_width]
+    columns = {}
+    for (field_name, field_type), start, end in zip(fields, starts, ends):
+        end = max(min(end, line_width), start)
+        width = end - start
+        if width:
+            column = numpy.ascontiguousarray(matrix[:, start:end])
+            column = numpy.char.strip(column.view('S{w}'.format(w=width)).ravel())
+        else:
+            column = numpy.zeros(len(matrix), dtype='S1')
+        numpy_type = get_numpy_type(field_type, width)
+        base_type, scale = split_field_type(field_type)
+        if base_type == 'fixed':
+            columns[field_name] = parse_fixed_point_column(column, scale or 0)
+        elif numpy_type.kind in 'if':
+            columns[field_name] = parse_numeric_column(column, numpy_type)
+        elif numpy_type.kind == 'U':
+            columns[field_name] = numpy.char.decode(column).astype(numpy_type)
+        else:
+            convert = get_type_converter(field_type)
+            columns[field_name] = numpy.array([convert(value.decode()) for value in column],
+                                              dtype=object)
+    return columns
+
+
+def read_delimited_columns(fields, record_file, field_separator):
+    """Reads a delimited record file into a dictionary of numpy column arrays.
+    """
+    schema = RecordSchema('Record', fields, field_separator=field_separator)
+    with open_file(record_file, 'rt') as records:
+        rows = [schema.convert(row) for row in schema.rows(records)]
+    columns = {}
+    for index, (field_name, field_type) in enumerate(fields):
+        values = [row[index] for row in rows]
+        numpy_type = get_numpy_type(field_type)
+        if numpy_type.kind in 'if':
+            values = [numpy.nan if value is None else value for value in values]
+            try:
+                columns[field_name] = numpy.array(values, dtype=numpy_type)
+            except ValueError:
+                columns[field_name] = numpy.array(values, dtype=numpy.float64)
+        elif field_type == 'string':
+            columns[field_name] = numpy.array([value or '' for value in values], dtype=str)
+        else:
+            columns[field_name] = numpy.array(values, dtype=object)
+    return columns
+
+
+def columns_to_structured_array(columns, field_names):
+    """Packs a dictionary of equal length column arrays into a numpy structured array.
+    """
+    dtype = [(field_name, columns[field_name].dtype) for field_name in field_names]
+    length = len(columns[field_names[0]]) if field_names else 0
+    array = numpy.empty(length, dtype=dtype)
+    for field_name in field_names:
+        array[field_name] = columns[field_name]
+    return array
+
+
+def column_reader(fields, start_positions=None, field_separator=None):
+    """Closure function returning the function that reads one record file into
+    a dictionary of numpy column arrays.
+    """
+    def read_columns(record_file):
+        if start_positions:
+            return read_fixed_width_columns(fields, record_file, start_positions)
+        return read_delimited_columns(fields, record_file, field_separator)
+    return read_columns
+
+
+def filter_columns(arrays, where):
+    """Returns the column arrays restricted to the rows that pass the where
+    filters, a list of (field_name, operator, value) tests as in RecordSchema.
+    Missing values (None or nan) and values the test fails on are rejected.
+    """
+    if where and isinstance(where[0], str):
+        where = [where]
+    length = len(next(iter(arrays.values()))) if arrays else 0
+    keep = numpy.ones(length, dtype=bool)
+    for field_name, operator_name, value in where:
+        test = make_operator(operator_name)
+
+        def accept(item):
+            if item is None or (isinstance(item, float) and item != item):
+                return False
+            try:
+                return bool(test(item, value))
+            except:
+                return False
+
+        keep &= numpy.fromiter((accept(item) for item in arrays[field_name].tolist()),
+                               dtype=bool, count=length)
+    return {field_name: array[keep] for field_name, array in arrays.items()}
+
+
+def read_records_as_columns(fields, record_files, start_positions=None, field_separator=None,
+                            columnar='columns', cache_directory=None, cache=False, where=None,
+                            columns=None):
+    """Reads the record files into numpy arrays instead of named tuples. Returns
+    a dictionary of column arrays if columnar is 'columns', or a single numpy
+    structured array if columnar is 'array'. Fixed width files (given by
+    start_positions) are parsed a column at a time over the whole file buffer.
+    If cache is True, each file's columns are memory mapped from a sidecar
+    cache (see record_cache_utils), which is written on the first read.
+    where filters the rows (see filter_columns) and columns picks the fields
+    returned, after the whole files are parsed (or loaded from the cache).
+    """
+    if numpy is None:
+        raise ImportError('numpy is required for columnar record output.')
+    field_names = [field[0] for field in fields]
+    read_columns = column_reader(fields, start_positions, field_separator)
+    description = ['columns', fields, start_positions, field_separator]
+    file_columns = []
+    for record_file in record_files:
+        if cache:
+            file_columns.append(get_cached_columns(record_file, description, read_columns,
+                                                   cache_directory))
+        else:
+            file_columns.append(read_columns(record_file))
+    if len(file_columns) == 1:
+        arrays = file_columns[0]
+    else:
+        arrays = {field_name: numpy.concatenate([c[field_name] for c in file_columns])
+                  for field_name in field_names}
+    if columns:
+        field_names = list(columns)
+    if where:
+        arrays = filter_columns(arrays, where)
+    arrays = {field_name: arrays[field_name] for field_name in field_names}
+    if columnar == 'array':
+        return columns_to_structured_array(arrays, field_names)
+    return arrays
+
+
+def iter_cached_records(type_name, fields, record_files, slices=[], field_separator=None,
+                        keyword_converter=None, where=None, columns=None, cache_directory=None):
+    """Generator yielding the records of the record files, loading each file's
+    parsed values from its memory mapped sidecar cache (see record_cache_utils)
+    when the cache is current, and parsing and caching the file otherwise. Records
+    are yielded as they are parsed or decoded, a chunk at a time. The output of a
+    keyword_converter cannot be told apart from another converter's in the cache
+    key, so with a keyword_converter the files are parsed without caching.
+    """
+    if keyword_converter:
+        for record_file in record_files:
+            for record in iter_records(type_name, fields, record_file, slices, field_separator,
+                                       keyword_converter, where, columns):
+                yield record
+        return
+    schema = RecordSchema(type_name, fields, slices, field_separator, where, columns)
+    description = ['records', fields, [[interval.start, interval.stop] for interval in
+                   slices or []], field_separator, where, columns]
+
+    def iter_values(record_file):
+        for record in iter_records(type_name, fields, record_file, slices, field_separator,
+                                   keyword_converter, where, columns):
+            yield tuple(record)
+
+    for record_file in record_files:
+        for values in iter_cached_values(record_file, description, iter_values,
+                                         cache_directory):
+            yield schema.named_tuple._make(values)
+
+
+def get_records_as_tuples(properties, source='property_file', stream=False, columnar=None,
+                          where=None, columns=None, cache=False, cache_directory=None):
     """Reads a properties dictionary and turns the records into
-    named tuples of the type passed.
+    named tuples of the type passed. If stream is True, returns a generator
+    yielding the records one at a time instead of a list. If columnar is
+    'columns' or 'array', returns numpy column arrays or a numpy structured
+    array instead (see read_records_as_columns, the keyword converter is not applied).
+    where, a list of (field_name, operator, value) filters, and columns, a list of
+    field names to decode, are applied before type conversion (see RecordSchema),
+    or to the parsed arrays with columnar output (see filter_columns).
+    If cache is True (or a cache_directory property is given), parsed files are
+    cached in binary sidecars next to the records or in the cache directory, and
+    read from there while the source file is unchanged (see record_cache_utils).
+    Caching is not used together with a checkpoint file or a keyword converter.
     """
     try:
         records_file = properties['records_file'][0]
@@ -163,14 +814,44 @@ def get_records_as_tuples(properties, source='property_file'):
         field_types = list(zip(properties['field_names'], properties['field_types']))
     except:
         field_types = [(field_name, 'string') for field_name in properties['field_names']]
+    try:
+        workers = int(properties['workers'][0])
+    except KeyError:
+        workers = None
+    try:
+        checkpoint_file = properties['checkpoint_file'][0]
+    except KeyError:
+        checkpoint_file = None
+    try:
+        cache_directory = properties['cache_directory'][0]
+        cache = True
+    except KeyError:
+        pass
     if records_directory:
-        records = read_records_from_directory(type_name, field_types, records_extension,
+        record_files = get_record_files(records_extension, records_directory)
+    else:
+        record_files = [records_file]
+    if columnar:
+        return read_records_as_columns(field_types, record_files,
+                                       properties.get('field_start_positions'),
+                                       field_separator, columnar, cache_directory, cache,
+                                       where, columns)
+    if cache and not checkpoint_file:
+        records = iter_cached_records(type_name, field_types, record_files, slices,
+                                      field_separator, keyword_converter, where, columns,
+                                      cache_directory)
+    elif records_directory:
+        records = iter_records_from_directory(type_name, field_types, records_extension,
                                               records_directory, slices, field_separator,
-                                              keyword_converter)
+                                              keyword_converter, workers,
+                                              checkpoint_file=checkpoint_file, where=where,
+                                              columns=columns)
     else:
-        records = read_records(type_name, field_types, records_file, slices, field_separator,
-                               keyword_converter)
-    return records
+        records = iter_records(type_name, field_types, records_file, slices, field_separator,
+                               keyword_converter, where, columns)
+    if stream:
+        return records
+    return list(records)
 
 
 def get_records_from_file(variables):
@@ -179,6 +860,13 @@ def get_records_from_file(variables):
     have other instructions), a file path, and optionally a field separator,
     and returns the records from the file.
     """
+    return list(iter_records_from_file(variables))
+
+
+def iter_records_from_file(variables):
+    """Generator version of get_records_from_file, yielding one record dictionary
+    at a time.
+    """
     fields = variables['fields']
     field_types = [(field['name'], field['type']) for field in fields]
     path = variables['path']
@@ -189,8 +877,101 @@ def get_records_from_file(variables):
     if 'start_position' in list(fields[0].keys()):
         start_positions = [field['start_position'] for field in fields]
         slices = make_slices(make_intervals(strings_to_ints(start_positions)))
-    records = read_records('Record', field_types, path, slices, separator)
-    return list(map(named_tuple_to_dictionary, records))
+    records = iter_records('Record', field_types, path, slices, separator)
+    return map(named_tuple_to_dictionary, records)
+
+
+def get_record_size(record):
+    """Returns an estimate of the in memory size in bytes of a named tuple or
+    dictionary record.
+    """
+    values = record.values() if isinstance(record, dict) else record
+    return sys.getsizeof(record) + sum(sys.getsizeof(value) for value in values)
+
+
+def chunk_records(records, chunk_size=1000, max_bytes=None):
+    """Generator grouping an iterable of records into lists of at most chunk_size
+    records. If max_bytes is given, a chunk is also closed once the estimated
+    size of its records reaches max_bytes.
+    """
+    chunk = []
+    chunk_bytes = 0
+    for record in records:
+        chunk.append(record)
+        if max_bytes:
+            chunk_bytes += get_record_size(record)
+        if len(chunk) >= chunk_size or (max_bytes and chunk_bytes >= max_bytes):
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
+    if chunk:
+        yield chunk
+
+
+def prefetch_chunks(chunks, prefetch=2):
+    """Generator that reads the given chunks on a background thread, keeping at
+    most prefetch chunks waiting in a queue, so producing the next chunks overlaps
+    with the consumer's work on the current one. Exceptions raised while producing
+    are re-raised to the consumer.
+    """
+    chunk_queue = queue.Queue(maxsize=max(prefetch, 1))
+    stop = threading.Event()
+    finished = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                chunk_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for chunk in chunks:
+                if not put(chunk):
+                    return
+            put(finished)
+        except BaseException as error:
+            put(error)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = chunk_queue.get()
+            if item is finished:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+
+
+def get_record_chunks(properties, chunk_size=1000, max_bytes=None, prefetch=2):
+    """Reads a properties dictionary (as get_records_as_tuples) and yields the
+    named tuple records in lists of at most chunk_size records or max_bytes bytes,
+    for bulk consumers such as mongo_insert_many. Set prefetch to 0 to parse in
+    the calling thread instead of in the background.
+    """
+    chunks = chunk_records(get_records_as_tuples(properties, stream=True), chunk_size,
+                           max_bytes)
+    if prefetch:
+        return prefetch_chunks(chunks, prefetch)
+    return chunks
+
+
+def get_record_chunks_from_file(variables, chunk_size=1000, max_bytes=None, prefetch=2):
+    """Reads a variables dictionary (as get_records_from_file) and yields the record
+    dictionaries in lists of at most chunk_size records or max_bytes bytes.
+    """
+    chunks = chunk_records(iter_records_from_file(variables), chunk_size, max_bytes)
+    if prefetch:
+        return prefetch_chunks(chunks, prefetch)
+    return chunks
 
 
 def named_tuple_to_dictionary(named_tuple):
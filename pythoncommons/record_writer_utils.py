@@ -1,5 +1,11 @@
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from operator import attrgetter
 from pythoncommons.general_utils import translate_delimiter, get_timestamp
+from pythoncommons.compression_utils import open_file, compressed_openers, is_compressed
+import os
+import threading
 
 
 def get_name(named_tuple):
@@ -47,43 +53,374 @@ def tuple_to_delimited_string(record, fields, delimiter):
     return file_string
 
 
+class FixedWidthFormatter(object):
+    """Formatter compiled once from a list of field tuples as
+    (field_name, start, end, justify). Widths, gaps and justification are worked
+    out up front into a single format template, so formatting a record is one
+    str.format call. Produces the same lines as tuple_to_fixed_string.
+    """
+
+    def __init__(self, fields):
+        alignments = {'left': '<', 'right': '>'}
+        template = []
+        previous_end = None
+        self.justified = []
+        for index, (field_name, start, end, justify) in enumerate(fields):
+            if previous_end is not None and int(start) - previous_end > 0:
+                template.append(' ' * (int(start) - previous_end))
+            width = int(end) - int(start)
+            alignment = alignments.get(justify)
+            if alignment:
+                template.append('{{{i}:{a}{w}.{w}}}'.format(i=index, a=alignment, w=width))
+            else:
+                template.append('{{{i}:.{w}}}'.format(i=index, w=width))
+            self.justified.append(bool(alignment))
+            previous_end = int(end)
+        template.append('\n')
+        self.template = ''.join(template)
+        self.widths = [int(field[2]) - int(field[1]) for field in fields]
+        if len(fields) == 1:
+            get_value = attrgetter(fields[0][0])
+            self.get_values = lambda record: (get_value(record),)
+        else:
+            self.get_values = attrgetter(*[field[0] for field in fields])
+        if not all(self.justified):
+            self.format = self.format_unjustified
+
+    def format(self, record):
+        return self.template.format(*map(str, self.get_values(record)))
+
+    def format_unjustified(self, record):
+        """Fields with a justify other than left or right are only written when
+        they have to be truncated, matching tuple_to_fixed_string.
+        """
+        values = [value if justified or len(value) > width else ''
+                  for value, width, justified in zip(map(str, self.get_values(record)),
+                                                     self.widths, self.justified)]
+        return self.template.format(*values)
+
+
+class DelimitedFormatter(object):
+    """Formatter compiled once from a list of field names and a delimiter.
+    Produces the same lines as tuple_to_delimited_string.
+    """
+
+    def __init__(self, fields, delimiter):
+        self.get_values = [attrgetter(field) for field in fields]
+        self.delimiter = delimiter
+
+    def format(self, record):
+        delimiter = self.delimiter
+        return delimiter.join([str(get_value(record)) for get_value in self.get_values]) + \
+            delimiter + '\n'
+
+
+class RecordWriter(object):
+    """Writes records through a compiled formatter, joining the formatted lines
+    into blocks of about buffer_size characters so each write() call covers many
+    records. Accepts any iterable (or generator) of records. File names ending
+    in .gz, .bz2 or .xz are compressed as they are written.
+    """
+
+    def __init__(self, file_name, formatter, mode="a+", buffer_size=1048576):
+        self.file_name = file_name
+        self.formatter = formatter
+        self.buffer_size = buffer_size
+        self.open_file = open_file(file_name, mode, buffer_size=buffer_size)
+
+    def write(self, records):
+        """Writes the records, returning the number of records written.
+        """
+        format_record = self.formatter.format
+        lines = []
+        length = 0
+        count = 0
+        for record in records:
+            line = format_record(record)
+            lines.append(line)
+            length += len(line)
+            count += 1
+            if length >= self.buffer_size:
+                self.open_file.write(''.join(lines))
+                lines = []
+                length = 0
+        if lines:
+            self.open_file.write(''.join(lines))
+        return count
+
+    def close(self):
+        self.open_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FileHandlePool(object):
+    """Bounded pool of open files, closing the least recently used file when more
+    than max_open files are needed. Files are opened in append mode, so a file
+    closed by the pool carries on where it left off when it is reopened.
+    """
+
+    def __init__(self, max_open=32, buffer_size=65536):
+        self.max_open = max(max_open, 1)
+        self.buffer_size = buffer_size
+        self.open_files = OrderedDict()
+
+    def get(self, file_name):
+        handle = self.open_files.pop(file_name, None)
+        if handle is None:
+            if len(self.open_files) >= self.max_open:
+                self.open_files.popitem(last=False)[1].close()
+            handle = open_file(file_name, "a+", buffer_size=self.buffer_size)
+        self.open_files[file_name] = handle
+        return handle
+
+    def close_file(self, file_name):
+        handle = self.open_files.pop(file_name, None)
+        if handle is not None:
+            handle.close()
+
+    def close_all(self):
+        while self.open_files:
+            self.open_files.popitem()[1].close()
+
+
+def get_partition_file_name(base_name, key, part=0):
+    """Returns the output file name for a partition key, adding the part number
+    for files after the first one in a rotated partition. The key goes before the
+    extension, and any compression extension, of the base name, e.g.
+    stations.csv.gz becomes stations_KX01.csv.gz.
+    """
+    key = str(key).replace(os.sep, '_')
+    compressed = ''
+    for compressed_extension in compressed_openers:
+        if base_name.endswith(compressed_extension):
+            base_name = base_name[:-len(compressed_extension)]
+            compressed = compressed_extension
+    base_name, extension = os.path.splitext(base_name)
+    extension += compressed
+    if part:
+        return '{b}_{k}_{p}{e}'.format(b=base_name, k=key, p=part, e=extension)
+    return '{b}_{k}{e}'.format(b=base_name, k=key, e=extension)
+
+
+class PartitionedRecordWriter(object):
+    """Writes each record to a file chosen by its partition key, given either as a
+    field name or a function of the record (e.g. one file per station or per month).
+    A partition file is rotated to a new part once it holds max_rows records or
+    max_bytes characters, counting what earlier runs left in it (full parts are
+    skipped). At most max_open_files files are kept open at once. If workers is
+    given, records are formatted in the calling thread and written in batches of
+    batch_size on that many threads, each partition always going to the same
+    thread to keep its order. At most max_in_flight batches (default four per
+    worker) are queued at once; the caller waits for the writes beyond that.
+    """
+
+    def __init__(self, base_name, formatter, partition_key, max_bytes=None, max_rows=None,
+                 max_open_files=32, workers=None, batch_size=1000, max_in_flight=None):
+        self.base_name = base_name
+        self.formatter = formatter
+        if callable(partition_key):
+            self.get_key = partition_key
+        else:
+            self.get_key = attrgetter(partition_key)
+        self.max_bytes = max_bytes
+        self.max_rows = max_rows
+        self.workers = workers
+        self.batch_size = batch_size
+        self.partitions = {}
+        self.file_names = []
+        pool_count = workers or 1
+        self.pools = [FileHandlePool(max(max_open_files // pool_count, 1))
+                      for _ in range(pool_count)]
+        self.executors = [ThreadPoolExecutor(max_workers=1) for _ in range(workers or 0)]
+        self.futures = []
+        self.pending = {}
+        self.in_flight = threading.Semaphore(max(max_in_flight or (workers or 1) * 4, 1))
+
+    def get_worker(self, key):
+        return hash(key) % len(self.pools)
+
+    def get_existing_size(self, file_name):
+        """Returns the (rows, bytes) already in a partition file, uncompressed. The
+        file is only read when there is a row limit or it is compressed; otherwise
+        its size is taken from the file system.
+        """
+        if not os.path.exists(file_name):
+            return 0, 0
+        if not self.max_rows and not is_compressed(file_name):
+            return 0, os.path.getsize(file_name)
+        if not self.max_rows and not self.max_bytes:
+            return 0, 0
+        rows = 0
+        size = 0
+        with open_file(file_name, "rb") as existing:
+            for line in existing:
+                rows += 1
+                size += len(line)
+        return rows, size
+
+    def open_part(self, key, part):
+        """Returns the partition state of the first part, from part on, that is under
+        both limits, counting the rows and size of part files left by earlier runs.
+        """
+        while True:
+            file_name = get_partition_file_name(self.base_name, key, part)
+            rows, size = self.get_existing_size(file_name)
+            if not ((self.max_rows and rows >= self.max_rows) or
+                    (self.max_bytes and size >= self.max_bytes)):
+                self.file_names.append(file_name)
+                return {'part': part, 'bytes': size, 'rows': rows, 'file_name': file_name}
+            part += 1
+
+    def get_partition(self, key):
+        partition = self.partitions.get(key)
+        if partition is None:
+            partition = self.open_part(key, 0)
+            self.partitions[key] = partition
+        return partition
+
+    def rotate(self, key, partition, pool):
+        pool.close_file(partition['file_name'])
+        partition.update(self.open_part(key, partition['part'] + 1))
+
+    def write_lines(self, key, lines):
+        """Writes formatted lines to the partition for key, rotating as needed.
+        """
+        pool = self.pools[self.get_worker(key)]
+        partition = self.get_partition(key)
+        block = []
+        for line in lines:
+            while (self.max_rows and partition['rows'] >= self.max_rows) or \
+                    (self.max_bytes and partition['bytes'] and
+                     partition['bytes'] + len(line) > self.max_bytes):
+                if block:
+                    pool.get(partition['file_name']).write(''.join(block))
+                    block = []
+                self.rotate(key, partition, pool)
+            block.append(line)
+            partition['rows'] += 1
+            partition['bytes'] += len(line)
+        if block:
+            pool.get(partition['file_name']).write(''.join(block))
+
+    def submit(self, key):
+        lines = self.pending.pop(key)
+        executor = self.executors[self.get_worker(key)]
+        self.in_flight.acquire()
+        try:
+            future = executor.submit(self.write_lines, key, lines)
+        except:
+            self.in_flight.release()
+            raise
+        future.add_done_callback(lambda done: self.in_flight.release())
+        self.futures.append(future)
+
+    def write(self, records):
+        """Writes the records to their partitions, returning the number written.
+        """
+        format_record = self.formatter.format
+        get_key = self.get_key
+        count = 0
+        for record in records:
+            key = get_key(record)
+            if self.executors:
+                self.pending.setdefault(key, []).append(format_record(record))
+                if len(self.pending[key]) >= self.batch_size:
+                    self.submit(key)
+            else:
+                self.write_lines(key, [format_record(record)])
+            count += 1
+        self.flush()
+        return count
+
+    def flush(self):
+        """Submits any partially filled batches and waits for the writes to finish,
+        re-raising the first write error.
+        """
+        for key in list(self.pending.keys()):
+            self.submit(key)
+        futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            for executor in self.executors:
+                executor.shutdown()
+            for pool in self.pools:
+                pool.close_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
 def write_fixed_length_strings(file_name, records, fields):
     """Should write fixed length strings to the specified file.
     """
-    with open(file_name, "a+") as open_file:
-        for record in records:
-            open_file.write(tuple_to_fixed_string(record, fields))
+    with RecordWriter(file_name, FixedWidthFormatter(fields)) as writer:
+        writer.write(records)
 
 
 def write_delimited_strings(file_name, delimiter, records, fields):
-    with open(file_name, "a+") as open_file:
-        for record in records:
-            open_file.write(tuple_to_delimited_string(record, fields, delimiter))
+    with RecordWriter(file_name, DelimitedFormatter(fields, delimiter)) as writer:
+        writer.write(records)
 
 
-def write_records(records, properties=None):
+def write_records(records, properties=None, partition_key=None, max_bytes=None, max_rows=None,
+                  max_open_files=32, workers=None):
     """This method takes a list of named tuple records and a properties file and
     produces an output file containing the records. The properties that are necessary
     are: field_names, and either field_start_positions or a field_separator.
-    Optionally, an output file should be specified.
+    Optionally, an output file should be specified. The records can be any
+    iterable, including a generator.
+    If a partition_key (a field name or a function of the record) or a
+    partition_field property is given, the records are split across one file
+    per key, named after the output file - see PartitionedRecordWriter. Returns
+    True, or the list of files written when partitioning.
     """
+    records = iter(records)
+    first_record = next(records, None)
+    if first_record is None:
+        return True
+    records = chain([first_record], records)
     try:
         file_name = properties['output_file'][0]
     except:
-        file_name = get_name(records[0]) + '_' + get_timestamp()
+        file_name = get_name(first_record) + '_' + get_timestamp()
     try:
         fields = properties['field_names']
     except:
-        fields = records[0]._fields
+        fields = first_record._fields
     try:
-        fields = list(zip(fields, properties['field_start_positions'],
-                     properties['field_end_positions'], properties['field_justify']))
-        write_fixed_length_strings(file_name, records, fields)
+        fixed_fields = list(zip(fields, properties['field_start_positions'],
+                                properties['field_end_positions'], properties['field_justify']))
     except:
+        fixed_fields = None
+    if fixed_fields:
+        formatter = FixedWidthFormatter(fixed_fields)
+    else:
         print('Trying to write records as delimited strings.')
         delimiter = translate_delimiter(properties['field_separator'][0])
         print(delimiter, ' (delimiter)')
-        write_delimited_strings(file_name, delimiter, records, fields)
+        formatter = DelimitedFormatter(fields, delimiter)
+    if not partition_key and properties and 'partition_field' in properties:
+        partition_key = properties['partition_field'][0]
+    if partition_key:
+        with PartitionedRecordWriter(file_name, formatter, partition_key, max_bytes, max_rows,
+                                     max_open_files, workers) as writer:
+            writer.write(records)
+        return writer.file_names
+    with RecordWriter(file_name, formatter) as writer:
+        writer.write(records)
     return True
 
 
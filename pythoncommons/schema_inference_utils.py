@@ -0,0 +1,192 @@
+from pythoncommons.property_writer_utils import write_dictionary_to_file
+import csv
+import keyword
+import os
+import re
+import sys
+
+"""
+Tools to propose a record schema (field names, field types and, for fixed width
+files, field start positions) for a new record file by sampling blocks of it.
+The proposed schema is a properties dictionary, in the same string:list form that
+property_reader_utils.make_dictionary returns, and can be written to a properties
+file for use with record_reader_utils.get_records_as_tuples.
+"""
+
+delimiter_names = {',': 'comma', '\t': 'tab', '|': 'pipe', ';': 'semicolon'}
+
+
+def sample_lines(record_file, sample_size=1000, block_count=10, block_size=65536):
+    """Returns up to sample_size complete lines of the record file, read from
+    block_count blocks of block_size bytes spread evenly through the file, so
+    only a small part of a large file is read. Small files are read entirely.
+    """
+    file_size = os.path.getsize(record_file)
+    with open(record_file, 'rb') as records:
+        if file_size <= block_count * block_size:
+            lines = records.read().splitlines()
+        else:
+            lines = []
+            lines_per_block = max(sample_size // block_count, 1)
+            for block in range(block_count):
+                offset = block * (file_size // block_count)
+                records.seek(offset)
+                block_lines = records.read(block_size).splitlines()
+                if offset:
+                    block_lines = block_lines[1:]
+                lines += block_lines[:-1][:lines_per_block]
+    lines = [line.decode(errors='replace').rstrip('\r\n') for line in lines]
+    return [line for line in lines if line.strip()][:sample_size]
+
+
+def is_integer(value):
+    try:
+        int(value)
+        return True
+    except ValueError:
+        return False
+
+
+def is_float(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def infer_field_type(values):
+    """Proposes a field type for a list of sampled string values. Blank values are
+    ignored. Numbers that all have the same number of decimal places are proposed
+    as decimal, other non integer numbers as float.
+    """
+    values = [value.strip() for value in values if value.strip()]
+    if not values:
+        return 'string'
+    if all(is_integer(value) for value in values):
+        return 'integer'
+    if not all(is_float(value) for value in values):
+        return 'string'
+    places = set()
+    for value in values:
+        if 'e' in value.lower() or '.' not in value:
+            return 'float'
+        places.add(len(value.split('.')[1]))
+    if len(places) == 1:
+        return 'decimal'
+    return 'float'
+
+
+def find_field_start_positions(lines):
+    """Finds the field start positions of fixed width lines from the columns that
+    are blank in every sampled line. A field starts at each non blank column that
+    follows a blank column (and at position 0).
+    """
+    width = max(len(line) for line in lines)
+    blank = [True] * width
+    for line in lines:
+        for position, character in enumerate(line):
+            if not character.isspace():
+                blank[position] = False
+    starts = [0]
+    for position in range(1, width):
+        if blank[position - 1] and not blank[position]:
+            starts.append(position)
+    return starts
+
+
+def sniff_delimiter(lines):
+    """Returns the field delimiter of delimited lines, or None if the lines do not
+    look delimited (for example fixed width lines).
+    """
+    try:
+        dialect = csv.Sniffer().sniff("\n".join(lines), delimiters="".join(delimiter_names))
+    except csv.Error:
+        return None
+    counts = [len(row) for row in csv.reader(lines, delimiter=dialect.delimiter)]
+    if counts[0] < 2 or len(set(counts)) > 1:
+        return None
+    return dialect.delimiter
+
+
+def make_field_names(count):
+    return ['field_{n}'.format(n=n + 1) for n in range(count)]
+
+
+def make_header_field_names(header):
+    """Turns the names of a header row into distinct valid field names, e.g.
+    'Station ID' becomes 'Station_ID'. Names that are blank or start with a digit
+    are prefixed with 'field_', keywords get a trailing '_', and repeated names
+    a numeric suffix.
+    """
+    field_names = []
+    for index, name in enumerate(header):
+        name = re.sub(r'\W+', '_', name.strip()).strip('_')
+        if not name:
+            name = 'field_{n}'.format(n=index + 1)
+        elif name[0].isdigit():
+            name = 'field_' + name
+        elif keyword.iskeyword(name):
+            name += '_'
+        unique_name = name
+        suffix = 2
+        while unique_name in field_names:
+            unique_name = '{n}_{s}'.format(n=name, s=suffix)
+            suffix += 1
+        field_names.append(unique_name)
+    return field_names
+
+
+def infer_schema(record_file, sample_size=1000, field_separator=None, block_count=10,
+                 block_size=65536):
+    """Samples the record file and returns a proposed properties dictionary with
+    field_names and field_types, plus either field_separator (delimited files) or
+    field_start_positions (fixed width files). The separator is sniffed unless given.
+    Delimited files with a header row take their field names from it (see
+    make_header_field_names). The record readers do not skip header rows, so the
+    header line must be removed from the file before it is read with the schema.
+    """
+    lines = sample_lines(record_file, sample_size, block_count, block_size)
+    if not lines:
+        return {}
+    if field_separator is None:
+        field_separator = sniff_delimiter(lines)
+    properties = {}
+    if field_separator:
+        rows = list(csv.reader(lines, delimiter=field_separator))
+        field_names = make_field_names(max(len(row) for row in rows))
+        try:
+            if csv.Sniffer().has_header("\n".join(lines)):
+                field_names = make_header_field_names(rows[0])
+                rows = rows[1:]
+        except csv.Error:
+            pass
+        properties['field_separator'] = [delimiter_names.get(field_separator, field_separator)]
+    else:
+        starts = find_field_start_positions(lines)
+        slices = [slice(start, end) for start, end in zip(starts, starts[1:] + [None])]
+        rows = [[line[interval] for interval in slices] for line in lines]
+        field_names = make_field_names(len(starts))
+        properties['field_start_positions'] = [str(start) for start in starts]
+    columns = [[row[index] if index < len(row) else '' for row in rows]
+               for index in range(len(field_names))]
+    properties['field_names'] = field_names
+    properties['field_types'] = [infer_field_type(column) for column in columns]
+    return properties
+
+
+def write_schema(record_file, properties_file, sample_size=1000, field_separator=None):
+    """Infers the schema of the record file and writes it as a properties file
+    readable by property_reader_utils.make_dictionary. Returns the properties.
+    A header row the field names were taken from is not skipped by the readers
+    and must be removed from the record file.
+    """
+    properties = infer_schema(record_file, sample_size, field_separator)
+    properties['records_file'] = [record_file]
+    write_dictionary_to_file(properties_file, properties)
+    return properties
+
+
+if __name__ == '__main__':
+    print('Inferring the schema of: ', sys.argv[1])
+    write_schema(sys.argv[1], sys.argv[2])
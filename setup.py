@@ -8,6 +8,9 @@ setup(
         'bson',
         'geojson'
     ],
+    extras_require={
+        'columnar': ['numpy']
+    },
     include_package_data=True,
     version='0.0.1',
     description='Generic, behavior grouped python utilities.',